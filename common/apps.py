@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CommonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'common'
+
+    def ready(self):
+        from . import fx  # noqa: F401  connects the snapshot invalidation signals
+        from . import reference_data  # noqa: F401  connects the reference payload invalidation signals
@@ -0,0 +1,161 @@
+# exchange_rates.py
+import datetime
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+import requests
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .fx import fx
+from .models import ExchangeRate, RefreshLease
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_RATE_LEASE = "exchange_rates"
+
+
+class OpenERApiProvider:
+    """USD-based rates from open.er-api.com."""
+
+    url = "https://open.er-api.com/v6/latest/USD"
+    timeout = 5
+
+    def __init__(self, max_retries=3, backoff_factor=1):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+    def fetch(self):
+        """Return (rates, next_update_time), or None if every attempt failed."""
+        for attempt in range(self.max_retries):
+            try:
+                response = requests.get(self.url, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+                next_update_time = datetime.datetime.fromtimestamp(data["time_next_update_unix"], tz=datetime.timezone.utc)
+                return data["rates"], next_update_time
+            except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                logger.warning(f"Exchange rate fetch attempt {attempt + 1} failed: {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.backoff_factor ** attempt)
+        logger.error("Failed to fetch exchange rates after multiple attempts.")
+        return None
+
+
+class StaticRateProvider:
+    """Fixed rates, for tests and local development without network access."""
+
+    default_rates = {"USD": 1, "CAD": 1.25, "EUR": 0.9, "GBP": 0.8, "JPY": 150}
+
+    def __init__(self, rates=None, ttl_seconds=86400):
+        self.rates = rates or getattr(settings, "EXCHANGE_RATE_STATIC_RATES", None) or self.default_rates
+        self.ttl_seconds = ttl_seconds
+
+    def fetch(self):
+        return self.rates, timezone.now() + timedelta(seconds=self.ttl_seconds)
+
+
+def get_provider():
+    provider_path = getattr(settings, "EXCHANGE_RATE_PROVIDER", "common.exchange_rates.OpenERApiProvider")
+    return import_string(provider_path)()
+
+
+def acquire_lease(name, owner, seconds):
+    """Take the named lease if it is free or expired. Only one holder across all processes."""
+    now = timezone.now()
+    locked_until = now + timedelta(seconds=seconds)
+    if RefreshLease.objects.filter(name=name, locked_until__lte=now).update(owner=owner, locked_until=locked_until):
+        return True
+    if RefreshLease.objects.filter(name=name).exists():
+        return False
+    try:
+        with transaction.atomic():
+            RefreshLease.objects.create(name=name, owner=owner, locked_until=locked_until)
+        return True
+    except IntegrityError:
+        # Another worker created the row first and holds the lease.
+        return False
+
+
+def release_lease(name, owner):
+    RefreshLease.objects.filter(name=name, owner=owner).update(locked_until=timezone.now())
+
+
+def rates_are_stale(snapshot=None):
+    snapshot = snapshot or fx.snapshot()
+    return not snapshot or snapshot.next_update_time is None or timezone.now() >= snapshot.next_update_time
+
+
+def write_exchange_rates(rates, next_update_time):
+    """Upsert today's snapshot with one statement; earlier dates are kept as history."""
+    date_fetched = timezone.now()
+    rate_date = timezone.localdate(date_fetched)
+    objs = [
+        ExchangeRate(target_currency=target_currency.upper(), rate=rate, rate_date=rate_date, date_fetched=date_fetched, next_update_time=next_update_time)
+        for target_currency, rate in rates.items()
+    ]
+    unique_fields = ["rate_date", "target_currency"] if connection.features.supports_update_conflicts_with_target else None
+    ExchangeRate.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=["rate", "date_fetched", "next_update_time"],
+    )
+    # bulk_create doesn't send post_save, so drop this process's snapshot explicitly.
+    fx.invalidate()
+    return len(objs)
+
+
+def refresh_exchange_rates(provider=None, force=False):
+    """Fetch and store new rates unless they are still fresh or another worker is already fetching.
+
+    Returns the number of rates written, 0 if nothing was done.
+    """
+    owner = uuid.uuid4().hex
+    lease_seconds = int(getattr(settings, "EXCHANGE_RATE_LEASE_SECONDS", 120))
+    if not acquire_lease(EXCHANGE_RATE_LEASE, owner, lease_seconds):
+        logger.info("Exchange rate refresh already running elsewhere; skipping.")
+        return 0
+
+    try:
+        fx.invalidate()
+        if not force and not rates_are_stale():
+            return 0
+        result = (provider or get_provider()).fetch()
+        if not result:
+            return 0
+        rates, next_update_time = result
+        count = write_exchange_rates(rates, next_update_time)
+        logger.info(f"Stored {count} exchange rates; next update at {next_update_time}.")
+        return count
+    except Exception as e:
+        logger.error(f"Unexpected error updating exchange rates: {e}")
+        return 0
+    finally:
+        release_lease(EXCHANGE_RATE_LEASE, owner)
+
+
+_background_lock = threading.Lock()
+_background_thread = None
+
+
+def _refresh_and_close():
+    try:
+        refresh_exchange_rates()
+    finally:
+        connection.close()
+
+
+def refresh_in_background():
+    """Start a refresh on a daemon thread unless this process already has one running."""
+    global _background_thread
+    with _background_lock:
+        if _background_thread is not None and _background_thread.is_alive():
+            return False
+        _background_thread = threading.Thread(target=_refresh_and_close, name="exchange-rate-refresh", daemon=True)
+        _background_thread.start()
+        return True
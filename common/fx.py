@@ -0,0 +1,225 @@
+# fx.py
+import hashlib
+import logging
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
+from functools import cached_property
+from types import MappingProxyType
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ExchangeRate
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+# Products this close to half a cent are re-rounded with Decimal, so float error can't flip them.
+HALF_CENT_TOLERANCE = 1e-4
+
+# Generous bound on the relative error of cents times a float cross rate. Once a product's
+# absolute error could reach HALF_CENT_TOLERANCE (from about 1.1e11 cents) the row uses Decimal too.
+FLOAT_RELATIVE_ERROR = 2.0 ** -50
+
+# Largest magnitude convert_many accepts; its cents must fit in int64 with room to spare.
+MAX_AMOUNT = Decimal("1e15")
+
+
+def is_convertible(amount):
+    return amount.is_finite() and abs(amount) < MAX_AMOUNT
+
+
+class RateSnapshot:
+    """An immutable view of one fetched rate set (USD-based rates keyed by currency)."""
+
+    def __init__(self, rates, date_fetched=None, next_update_time=None):
+        self.rates = MappingProxyType(dict(rates))
+        self.date_fetched = date_fetched
+        self.next_update_time = next_update_time
+
+    def __bool__(self):
+        return bool(self.rates)
+
+    def get_rate(self, from_currency, to_currency):
+        """Rate that converts `from_currency` into `to_currency`, or None if either is unknown."""
+        from_currency = (from_currency or "").upper()
+        to_currency = (to_currency or "").upper()
+        if from_currency == to_currency:
+            return Decimal(1)
+        from_rate = self.rates.get(from_currency)
+        to_rate = self.rates.get(to_currency)
+        if from_rate is None or to_rate is None:
+            return None
+        return to_rate / from_rate
+
+    def convert(self, amounts, from_currency, to_currency):
+        """Convert an iterable of Decimal amounts, rounded to cents. Returns None if there is no rate."""
+        rate = self.get_rate(from_currency, to_currency)
+        if rate is None:
+            return None
+        return [(Decimal(amount) * rate).quantize(CENT) for amount in amounts]
+
+    @cached_property
+    def version(self):
+        """Content hash of the rates, for cache validators."""
+        digest = hashlib.sha256(str(self.date_fetched).encode())
+        for currency in sorted(self.rates):
+            digest.update(f";{currency}={self.rates[currency]}".encode())
+        return digest.hexdigest()[:32]
+
+    @cached_property
+    def currency_index(self):
+        return {currency: index for index, currency in enumerate(sorted(self.rates))}
+
+    @cached_property
+    def matrix(self):
+        """NxN float cross-rate matrix: matrix[i, j] converts currency i into currency j."""
+        usd_rates = np.array([float(self.rates[currency]) for currency in self.currency_index], dtype=np.float64)
+        return usd_rates[np.newaxis, :] / usd_rates[:, np.newaxis]
+
+    def cross_rates(self, base_currency):
+        """Rates from `base_currency` into every currency, or None if it is unknown."""
+        index = self.currency_index.get((base_currency or "").upper())
+        if index is None:
+            return None
+        return dict(zip(self.currency_index, self.matrix[index].tolist()))
+
+    def convert_many(self, amounts, from_currencies, to_currencies):
+        """Convert parallel sequences of (amount, from, to) in one vectorised pass.
+
+        Amounts are handled as integer cents and rounded half-even like Decimal.quantize;
+        the result holds a cent-rounded Decimal per row, or None where a currency is unknown.
+        Raises ValueError for an amount that is not finite or not below MAX_AMOUNT.
+        """
+        index_of = self.currency_index.get
+        from_currencies = [(currency or "").upper() for currency in from_currencies]
+        to_currencies = [(currency or "").upper() for currency in to_currencies]
+        amounts = [Decimal(amount) for amount in amounts]
+        for amount in amounts:
+            if not is_convertible(amount):
+                raise ValueError(f"Cannot convert amount {amount}")
+        cents = np.array([int(amount.quantize(CENT) * 100) for amount in amounts], dtype=np.int64)
+        from_index = np.array([index_of(currency, -1) for currency in from_currencies], dtype=np.int64)
+        to_index = np.array([index_of(currency, -1) for currency in to_currencies], dtype=np.int64)
+        # Same-currency rows convert at 1 even when the currency isn't in the snapshot, like get_rate().
+        same = (from_index == to_index) & (from_index >= 0)
+        for row in np.flatnonzero((from_index < 0) & (to_index < 0)).tolist():
+            same[row] = from_currencies[row] == to_currencies[row]
+
+        known = (from_index >= 0) & (to_index >= 0)
+        rates = np.ones(len(cents), dtype=np.float64)
+        if self.rates and known.any():
+            rates[known] = self.matrix[from_index[known], to_index[known]]
+        rates[same] = 1.0
+        known |= same
+
+        products = cents * rates
+        rounded = np.rint(products)
+        ties = np.abs(np.abs(products - np.trunc(products)) - 0.5) < HALF_CENT_TOLERANCE
+        ties |= np.abs(products) * FLOAT_RELATIVE_ERROR >= HALF_CENT_TOLERANCE
+
+        results = [Decimal(int(value)) * CENT for value in rounded.tolist()]
+        for row in np.flatnonzero(~known).tolist():
+            results[row] = None
+        for row in np.flatnonzero(known & ties).tolist():
+            rate = self.get_rate(from_currencies[row], to_currencies[row])
+            results[row] = (Decimal(int(cents[row])) * CENT * rate).quantize(CENT)
+        return results
+
+
+class FxService:
+    """Serves conversions from in-memory snapshots of the exchange_rate table.
+
+    Rates are stored as one snapshot per rate_date. The latest snapshot and any dated
+    snapshots already asked for are cached; all of them are replaced (never mutated)
+    when rates are written in this process. FX_SNAPSHOT_TTL bounds how long another
+    process's writes can go unseen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._dated = {}
+
+    def get_ttl(self):
+        return int(getattr(settings, "FX_SNAPSHOT_TTL", 300))
+
+    def load(self):
+        """Return (latest snapshot, sorted list of every stored rate_date)."""
+        rate_dates = list(ExchangeRate.objects.order_by("rate_date").values_list("rate_date", flat=True).distinct())
+        if not rate_dates:
+            return RateSnapshot({}), rate_dates
+        return self.load_dates([rate_dates[-1]])[rate_dates[-1]], rate_dates
+
+    def load_dates(self, rate_dates):
+        """Load the snapshots for several rate_dates with one query."""
+        rows = {}
+        for rate_date, target_currency, rate, date_fetched, next_update_time in ExchangeRate.objects.filter(
+            rate_date__in=rate_dates
+        ).values_list("rate_date", "target_currency", "rate", "date_fetched", "next_update_time"):
+            rates, fetched, next_update = rows.get(rate_date, ({}, None, None))
+            rates[target_currency] = rate
+            if fetched is None or date_fetched > fetched:
+                fetched, next_update = date_fetched, next_update_time
+            rows[rate_date] = (rates, fetched, next_update)
+        return {rate_date: RateSnapshot(*row) for rate_date, row in rows.items()}
+
+    def _state(self):
+        loaded = self._loaded
+        if loaded is not None and time.monotonic() - loaded[2] < self.get_ttl():
+            return loaded
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._loaded[2] >= self.get_ttl():
+                self._loaded = (*self.load(), time.monotonic())
+                self._dated = {}
+            return self._loaded
+
+    def snapshot(self):
+        return self._state()[0]
+
+    def snapshots_for(self, dates):
+        """Map each date in `dates` to the snapshot effective on it, loading missing ones in one query.
+
+        The effective snapshot is the latest rate_date on or before the date; dates that are
+        None or outside the stored history use the latest snapshot.
+        """
+        latest, rate_dates, _ = self._state()
+        effective = {}
+        for on in set(dates):
+            index = bisect_right(rate_dates, on) if on is not None else 0
+            effective[on] = rate_dates[index - 1] if 0 < index < len(rate_dates) else None
+
+        dated = self._dated
+        missing = {rate_date for rate_date in effective.values() if rate_date is not None and rate_date not in dated}
+        if missing:
+            loaded = self.load_dates(missing)
+            with self._lock:
+                self._dated = {**self._dated, **loaded}
+            dated = {**dated, **loaded}
+        return {on: dated.get(rate_date, latest) if rate_date else latest for on, rate_date in effective.items()}
+
+    def snapshot_for(self, on):
+        return self.snapshots_for([on])[on]
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = None
+            self._dated = {}
+
+    def get_rate(self, from_currency, to_currency, on=None):
+        return self.snapshot_for(on).get_rate(from_currency, to_currency)
+
+    def convert(self, amounts, from_currency, to_currency, on=None):
+        return self.snapshot_for(on).convert(amounts, from_currency, to_currency)
+
+
+fx = FxService()
+
+
+@receiver([post_save, post_delete], sender=ExchangeRate)
+def invalidate_fx_snapshot(sender, **kwargs):
+    fx.invalidate()
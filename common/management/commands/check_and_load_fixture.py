@@ -5,6 +5,8 @@ from django.apps import apps
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
+from common.reference_data import invalidate
+
 class Command(BaseCommand):
     help = "Check if data exists, load fixtures, and create a superuser."
 
@@ -31,6 +33,7 @@ class Command(BaseCommand):
             return
 
         # Process each entry in the fixture
+        loaded_models = set()
         for entry in fixture_data:
             model_name = entry["model"]
             pk = entry["pk"]
@@ -51,8 +54,13 @@ class Command(BaseCommand):
                 # Create the object if it doesn't exist
                 obj = model(pk=pk, **fields)
                 obj.save()
+                loaded_models.add(model)
                 print(f"[SUCCESS] Created new object in {model_name}: {fields}")
 
+        # Drop cached reference payloads for every table the fixture touched.
+        if loaded_models:
+            invalidate(*loaded_models)
+
     def create_superuser(self):
         from django.contrib.auth import get_user_model
         User = get_user_model()
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from common.exchange_rates import get_provider, refresh_exchange_rates
+from common.fx import fx
+
+
+class Command(BaseCommand):
+    help = "Fetch the latest exchange rates. With --loop, keep refreshing whenever the stored rates expire."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Fetch even if the stored rates are still fresh")
+        parser.add_argument("--loop", action="store_true", help="Run forever, sleeping until the next update time")
+        parser.add_argument("--min-interval", type=int, default=60, help="Minimum seconds between checks in --loop mode")
+        parser.add_argument("--max-interval", type=int, default=3600, help="Maximum seconds between checks in --loop mode")
+
+    def handle(self, *args, **options):
+        provider = get_provider()
+        force = options["force"]
+        while True:
+            count = refresh_exchange_rates(provider=provider, force=force)
+            if count:
+                print(f"[SUCCESS] Stored {count} exchange rates.")
+            else:
+                print("[INFO] Exchange rates are fresh or another worker is refreshing them.")
+            if not options["loop"]:
+                return
+            force = False
+            close_old_connections()
+
+            fx.invalidate()
+            next_update_time = fx.snapshot().next_update_time
+            wait = (next_update_time - timezone.now()).total_seconds() if next_update_time else 0
+            time.sleep(min(max(wait, options["min_interval"]), options["max_interval"]))
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0005_remove_mileagerate_title_alter_mileagerate_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('owner', models.CharField(blank=True, default='', max_length=100)),
+                ('locked_until', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'refresh_lease',
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_rate_date(apps, schema_editor):
+    ExchangeRate = apps.get_model('common', 'ExchangeRate')
+
+    seen = set()
+    duplicate_pks = []
+    for pk, target_currency, date_fetched in ExchangeRate.objects.order_by('-date_fetched', '-pk').values_list('pk', 'target_currency', 'date_fetched').iterator():
+        rate_date = timezone.localdate(date_fetched) if timezone.is_aware(date_fetched) else date_fetched.date()
+        if (rate_date, target_currency) in seen:
+            duplicate_pks.append(pk)
+            continue
+        seen.add((rate_date, target_currency))
+        ExchangeRate.objects.filter(pk=pk).update(rate_date=rate_date)
+    ExchangeRate.objects.filter(pk__in=duplicate_pks).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_refreshlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangerate',
+            name='rate_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(fill_rate_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='rate_date',
+            field=models.DateField(default=timezone.localdate),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('rate_date', 'target_currency'), name='exchange_rate_date_currency'),
+        ),
+    ]
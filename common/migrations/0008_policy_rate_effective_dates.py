@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0007_exchangerate_rate_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hoteldailybaserate',
+            name='effective_from',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='hoteldailybaserate',
+            name='effective_to',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mileagerate',
+            name='effective_from',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mileagerate',
+            name='effective_to',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mileagerate',
+            name='rate',
+            field=models.DecimalField(decimal_places=2, max_digits=3),
+        ),
+    ]
@@ -65,6 +65,8 @@ class HotelDailyBaseRate(models.Model):
     city = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = UppercaseCharField(max_length=5)
+    effective_from = models.DateField(null=True, blank=True)
+    effective_to = models.DateField(null=True, blank=True)
 
     class Meta:
         db_table = 'hotel_daily_base_rate'
@@ -73,8 +75,10 @@ class HotelDailyBaseRate(models.Model):
         return f'{self.country} {self.city} {self.amount} {self.currency}'
 
 class MileageRate(models.Model):
-    rate = models.DecimalField(max_digits=3, decimal_places=2, unique=True)
+    rate = models.DecimalField(max_digits=3, decimal_places=2)
     value = models.CharField(max_length=3, null=True, blank=True)
+    effective_from = models.DateField(null=True, blank=True)
+    effective_to = models.DateField(null=True, blank=True)
 
     class Meta:
         db_table = 'mileage_rate'
@@ -85,8 +89,33 @@ class MileageRate(models.Model):
 class ExchangeRate(models.Model):
     target_currency = UppercaseCharField(max_length=5)
     rate = models.DecimalField(max_digits=20, decimal_places=6)
+    rate_date = models.DateField(default=timezone.localdate)
     date_fetched = models.DateTimeField(default=timezone.now)
     next_update_time = models.DateTimeField()
     
     class Meta:
-        db_table = 'exchange_rate'
\ No newline at end of file
+        db_table = 'exchange_rate'
+        constraints = [
+            models.UniqueConstraint(fields=['rate_date', 'target_currency'], name='exchange_rate_date_currency'),
+        ]
+
+class RefreshLease(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=100, blank=True, default='')
+    locked_until = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'refresh_lease'
+
+    def __str__(self):
+        return f'{self.name} {self.owner} {self.locked_until}'
+
+class ReferenceDataVersion(models.Model):
+    table = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'reference_data_version'
+
+    def __str__(self):
+        return f'{self.table} {self.version}'
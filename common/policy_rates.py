@@ -0,0 +1,179 @@
+# policy_rates.py
+import re
+import threading
+from datetime import date
+
+from django.utils import timezone
+
+from .models import HotelDailyBaseRate, MileageRate
+from .reference_data import get_versions
+
+# "Bellevue/Seattle, WA" covers Bellevue and Seattle; the trailing region code is dropped.
+_REGION_SUFFIX = re.compile(r",\s*[a-z]{2}$")
+
+
+def normalize_key(value):
+    """Case- and whitespace-insensitive form of a country, city or company code."""
+    return " ".join(str(value).split()).casefold() if value is not None else ""
+
+
+def city_aliases(city_key):
+    """The normalized city label plus each "/"-separated city it names."""
+    aliases = {city_key}
+    for part in city_key.split("/"):
+        part = _REGION_SUFFIX.sub("", part.strip()).strip()
+        if part:
+            aliases.add(part)
+    return aliases
+
+
+class EffectiveRates:
+    """The versions of one rate, ordered by effective_from, picked by date."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, effective_from, effective_to, row):
+        self.entries.append((effective_from or date.min, effective_to or date.max, row))
+
+    def freeze(self):
+        # Rows arrive in pk order; reversing before the stable sort puts the lowest pk last
+        # among equal start dates, so it is the one on() returns.
+        self.entries.reverse()
+        self.entries.sort(key=lambda entry: entry[0])
+
+    def on(self, day):
+        for effective_from, effective_to, row in reversed(self.entries):
+            if effective_from <= day <= effective_to:
+                return row
+        return None
+
+
+class CompiledPolicyRates:
+    """Hotel and mileage limits compiled into dicts for O(1) lookups.
+
+    Keys are normalized here from the country, city and value columns, so rows written by
+    loaddata or QuerySet.update() resolve like any other. Hotel rates are keyed by (country,
+    city) with every city alias of a grouped label, plus a city-only index used when the
+    caller has no country; a city found in several countries is then ambiguous and resolves
+    to nothing. Mileage rates are keyed by company code.
+    """
+
+    def __init__(self, hotel_rows, mileage_rows, hotel_fields, mileage_fields):
+        self.hotel_fields = hotel_fields
+        self.mileage_fields = mileage_fields
+        self.hotel_by_place = {}
+        self.hotel_countries = {}
+        self.mileage_by_company = {}
+
+        position = {name: index for index, name in enumerate(hotel_fields)}
+        for row in hotel_rows:
+            country_key = normalize_key(row[position["country"]])
+            for alias in city_aliases(normalize_key(row[position["city"]])):
+                rates = self.hotel_by_place.setdefault((country_key, alias), EffectiveRates())
+                rates.add(row[position["effective_from"]], row[position["effective_to"]], row)
+                self.hotel_countries.setdefault(alias, set()).add(country_key)
+
+        position = {name: index for index, name in enumerate(mileage_fields)}
+        for row in mileage_rows:
+            rates = self.mileage_by_company.setdefault(normalize_key(row[position["value"]]), EffectiveRates())
+            rates.add(row[position["effective_from"]], row[position["effective_to"]], row)
+
+        for rates in [*self.hotel_by_place.values(), *self.mileage_by_company.values()]:
+            rates.freeze()
+
+    def hotel_rate(self, city, country=None, on=None):
+        """The HotelDailyBaseRate in effect for the city on `on` (default today), or None."""
+        city_key = normalize_key(city)
+        if not city_key:
+            return None
+        on = on or timezone.localdate()
+        if country:
+            country_keys = [normalize_key(country)]
+        else:
+            country_keys = self.hotel_countries.get(city_key, set())
+            if len(country_keys) != 1:
+                return None
+
+        for country_key in country_keys:
+            rates = self.hotel_by_place.get((country_key, city_key))
+            row = rates.on(on) if rates else None
+            if row is not None:
+                return HotelDailyBaseRate.from_db("default", self.hotel_fields, row)
+        return None
+
+    def mileage_rate(self, company_code, on=None):
+        """The MileageRate in effect for the company on `on` (default today), or None."""
+        rates = self.mileage_by_company.get(normalize_key(company_code))
+        row = rates.on(on or timezone.localdate()) if rates else None
+        return MileageRate.from_db("default", self.mileage_fields, row) if row is not None else None
+
+    def resolve_item(self, expense_type, city, company_code, on=None):
+        """(hotel_daily_base_rate, mileage_rate) for an item of this type."""
+        hotel_rate = self.hotel_rate(city, on=on) if expense_type == "Hotel" else None
+        mileage_rate = self.mileage_rate(company_code, on=on) if expense_type == "Mileage" else None
+        return hotel_rate, mileage_rate
+
+
+class PolicyRateEngine:
+    """Serves CompiledPolicyRates, recompiling when either rate table's version changes.
+
+    Versions come from the process-local copy in reference_data, so a warm engine answers
+    hotel and mileage lookups without a query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    def compile(self):
+        hotel_fields = [field.attname for field in HotelDailyBaseRate._meta.concrete_fields]
+        mileage_fields = [field.attname for field in MileageRate._meta.concrete_fields]
+        return CompiledPolicyRates(
+            HotelDailyBaseRate.objects.order_by("pk").values_list(*hotel_fields),
+            MileageRate.objects.order_by("pk").values_list(*mileage_fields),
+            hotel_fields,
+            mileage_fields,
+        )
+
+    def compiled(self):
+        versions = get_versions([HotelDailyBaseRate, MileageRate])
+        version = (versions[HotelDailyBaseRate], versions[MileageRate])
+        compiled = self._compiled
+        if compiled is None or compiled[0] != version:
+            compiled = (version, self.compile())
+            with self._lock:
+                self._compiled = compiled
+        return compiled[1]
+
+    def clear(self):
+        with self._lock:
+            self._compiled = None
+
+    def hotel_rate(self, city, country=None, on=None):
+        return self.compiled().hotel_rate(city, country=country, on=on)
+
+    def mileage_rate(self, company_code, on=None):
+        return self.compiled().mileage_rate(company_code, on=on)
+
+    def apply_to_items(self, items, company_code):
+        """Set hotel_daily_base_rate and mileage_rate on each item from one compiled lookup.
+
+        Items need `city` loaded (or select_related). The rate objects are always assigned, so
+        callers can read them without another query. Returns the items whose rates changed,
+        ready for bulk_update(["hotel_daily_base_rate", "mileage_rate"]).
+        """
+        compiled = self.compiled()
+        changed = []
+        for item in items:
+            city = item.city.value if item.city_id else None
+            hotel_rate, mileage_rate = compiled.resolve_item(item.expense_type, city, company_code, on=item.expense_date)
+            previous = (item.hotel_daily_base_rate_id, item.mileage_rate_id)
+            item.hotel_daily_base_rate = hotel_rate
+            item.mileage_rate = mileage_rate
+            if (item.hotel_daily_base_rate_id, item.mileage_rate_id) != previous:
+                changed.append(item)
+        return changed
+
+
+policy_rates = PolicyRateEngine()
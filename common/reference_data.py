@@ -0,0 +1,281 @@
+# reference_data.py
+import gzip
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from rest_framework.renderers import JSONRenderer
+
+from .models import (
+    Airline, CarType, City, HotelDailyBaseRate, MealCategory, MileageRate, ReferenceDataVersion, RelationshipToPAI, RentalAgency,
+)
+from .serializers import (
+    AirlineSerializer, CarTypeSerializer, CitySerializer, HotelDailyBaseRateSerializer, MealCategorySerializer,
+    MileageRateSerializer, RelationshipToPAISerializer, RentalAgencySerializer,
+)
+
+# Bump when a serializer's output changes so payloads cached by the previous deploy are ignored.
+PAYLOAD_VERSION = 2
+
+REFERENCE_SERIALIZERS = {
+    Airline: AirlineSerializer,
+    RentalAgency: RentalAgencySerializer,
+    CarType: CarTypeSerializer,
+    MealCategory: MealCategorySerializer,
+    RelationshipToPAI: RelationshipToPAISerializer,
+    City: CitySerializer,
+    HotelDailyBaseRate: HotelDailyBaseRateSerializer,
+    MileageRate: MileageRateSerializer,
+}
+
+
+class ReferencePayload:
+    """One table rendered to JSON bytes, with a content-hash ETag."""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def get_cache_key(model, version):
+    return f"reference-data:v{PAYLOAD_VERSION}:{model._meta.db_table}:{version}"
+
+
+class ReferenceVersions:
+    """Process-local copy of the reference_data_version counters.
+
+    Every table's counter is read with one query and reused for REFERENCE_VERSION_TTL
+    seconds, so cached payloads, indexes and compiled rates are served without touching
+    the database. invalidate() drops the copy, so writes made in this process are seen
+    at once; the TTL bounds how long another process's writes can go unseen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def get_ttl(self):
+        return int(getattr(settings, "REFERENCE_VERSION_TTL", 30))
+
+    def load(self):
+        return dict(ReferenceDataVersion.objects.values_list("table", "version"))
+
+    def _state(self):
+        loaded = self._loaded
+        if loaded is not None and time.monotonic() - loaded[1] < self.get_ttl():
+            return loaded[0]
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._loaded[1] >= self.get_ttl():
+                self._loaded = (self.load(), time.monotonic())
+            return self._loaded[0]
+
+    def get(self, models):
+        versions = self._state()
+        return {model: versions.get(model._meta.db_table, 0) for model in models}
+
+    def clear(self):
+        with self._lock:
+            self._loaded = None
+
+
+reference_versions = ReferenceVersions()
+
+
+def get_versions(models):
+    """Current version of each table; a table with no counter row yet is at version 0.
+
+    The counters live in the database, so a write seen by one process is seen by all of
+    them (within REFERENCE_VERSION_TTL) whatever cache backend is configured.
+    """
+    return reference_versions.get(models)
+
+
+def get_cache_timeout():
+    # Payloads are keyed by table version, so this only bounds how long superseded ones linger.
+    return int(getattr(settings, "REFERENCE_DATA_CACHE_TIMEOUT", 86400))
+
+
+def render_payload(model):
+    serializer = REFERENCE_SERIALIZERS[model](model.objects.all(), many=True)
+    return ReferencePayload(JSONRenderer().render(serializer.data))
+
+
+def get_payload(model):
+    """The cached payload for a reference table, rendered on first use after an invalidation."""
+    key = get_cache_key(model, get_versions([model])[model])
+    payload = cache.get(key)
+    if payload is None:
+        payload = render_payload(model)
+        cache.set(key, payload, get_cache_timeout())
+    return payload
+
+
+def get_payloads(models):
+    """Payloads for several tables with one cache round trip, rendering any that are missing."""
+    versions = get_versions(models)
+    keys = {model: get_cache_key(model, version) for model, version in versions.items()}
+    cached = cache.get_many(list(keys.values()))
+    payloads, missing = {}, {}
+    for model, key in keys.items():
+        payloads[model] = cached.get(key)
+        if payloads[model] is None:
+            payloads[model] = missing[key] = render_payload(model)
+    if missing:
+        cache.set_many(missing, get_cache_timeout())
+    return payloads
+
+
+def invalidate(*models):
+    """Bump the version of each table, in the caller's transaction when there is one."""
+    tables = [model._meta.db_table for model in models or REFERENCE_SERIALIZERS if model in REFERENCE_SERIALIZERS]
+    if not tables:
+        return
+    with transaction.atomic():
+        ReferenceDataVersion.objects.bulk_create([ReferenceDataVersion(table=table) for table in tables], ignore_conflicts=True)
+        ReferenceDataVersion.objects.filter(table__in=tables).update(version=F("version") + 1)
+    # Drop the local copy now for this transaction's reads and again once the bump is visible to others.
+    reference_versions.clear()
+    transaction.on_commit(reference_versions.clear)
+
+
+class ReferenceIndex:
+    """Process-local maps from case-folded values to rows of the reference tables.
+
+    Each (table, field) map is built with one query and reused until the table's version
+    changes, so resolving a value is a dict lookup with no query while the version is
+    cached; a miss is checked against the table before it is reported as missing. When several rows share a value the
+    lowest pk wins. Every lookup returns a new instance, so no model object is shared
+    between requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def build(self, model, field):
+        field_names = [f.attname for f in model._meta.concrete_fields]
+        position = field_names.index(field)
+        rows = {}
+        for values in model.objects.order_by("pk").values_list(*field_names):
+            if values[position] is not None:
+                rows.setdefault(str(values[position]).casefold(), values)
+        return field_names, rows
+
+    def get_index(self, model, field, version):
+        entry = self._indexes.get((model, field))
+        if entry is None or entry[0] != version:
+            entry = (version, *self.build(model, field))
+            with self._lock:
+                self._indexes[(model, field)] = entry
+        return entry[1], entry[2]
+
+    def get(self, model, value, field="value"):
+        """The row of `model` whose `field` matches `value` ignoring case, or None."""
+        if value is None:
+            return None
+        field_names, rows = self.get_index(model, field, get_versions([model])[model])
+        values = rows.get(str(value).casefold())
+        if values is not None:
+            return model.from_db("default", field_names, values)
+        # A row written without bumping the version (QuerySet.bulk_create, raw SQL) is missing
+        # from the index; check the table once and rebuild the index next time if it is there.
+        instance = model.objects.filter(**{f"{field}__iexact": value}).order_by("pk").first()
+        if instance is not None:
+            with self._lock:
+                self._indexes.pop((model, field), None)
+        return instance
+
+    def get_many(self, model, values, field="value"):
+        """Map each distinct value in `values` to its row of `model`, or None, reading the version once."""
+        field_names, rows = self.get_index(model, field, get_versions([model])[model])
+        instances = {}
+        for value in set(values):
+            found = rows.get(str(value).casefold())
+            if found is not None:
+                instances[value] = model.from_db("default", field_names, found)
+            else:
+                instances[value] = self.get(model, value, field=field)
+        return instances
+
+    def clear(self):
+        with self._lock:
+            self._indexes = {}
+
+
+reference_index = ReferenceIndex()
+
+
+# Section name -> table, in the order they appear in the bootstrap document.
+BOOTSTRAP_SECTIONS = {
+    "airlines": Airline,
+    "rental_agencies": RentalAgency,
+    "car_types": CarType,
+    "meal_categories": MealCategory,
+    "relationships_to_pai": RelationshipToPAI,
+    "cities": City,
+    "hotel_daily_base_rates": HotelDailyBaseRate,
+    "mileage_rates": MileageRate,
+}
+
+
+class BootstrapBundle:
+    """Every reference table plus the current FX snapshot as one JSON document, also gzipped."""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.etag = f'"{version}"'
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6, mtime=0)
+
+
+_bootstrap_bundle = None
+
+
+def get_bootstrap_version(payloads, snapshot):
+    # Changes whenever any table's content or the FX snapshot changes.
+    digest = hashlib.sha256()
+    for name, model in BOOTSTRAP_SECTIONS.items():
+        digest.update(f"{name}={payloads[model].etag};".encode())
+    digest.update(f"exchange_rates={snapshot.version}".encode())
+    return digest.hexdigest()[:32]
+
+
+def get_bootstrap_bundle(snapshot):
+    """The bundle for the current tables and `snapshot`, rebuilt only when the version changes.
+
+    Sections are spliced from the cached per-table payloads without re-serializing them.
+    Those payloads are looked up by the database version counters, so a table written
+    through any worker changes the bundle version (and ETag) on every worker within
+    REFERENCE_VERSION_TTL.
+    """
+    global _bootstrap_bundle
+    payloads = get_payloads(BOOTSTRAP_SECTIONS.values())
+    version = get_bootstrap_version(payloads, snapshot)
+    bundle = _bootstrap_bundle
+    if bundle is not None and bundle.version == version:
+        return bundle
+
+    renderer = JSONRenderer()
+    parts = [b'{"version":', renderer.render(version)]
+    for name, model in BOOTSTRAP_SECTIONS.items():
+        parts += [b',"', name.encode(), b'":', payloads[model].body]
+    parts += [
+        b',"exchange_rates":', renderer.render(dict(snapshot.rates)),
+        b',"exchange_rates_date_fetched":', renderer.render(snapshot.date_fetched),
+        b"}",
+    ]
+    bundle = _bootstrap_bundle = BootstrapBundle(version, b"".join(parts))
+    return bundle
+
+
+def invalidate_reference_payload(sender, **kwargs):
+    invalidate(sender)
+
+
+for _model in REFERENCE_SERIALIZERS:
+    post_save.connect(invalidate_reference_payload, sender=_model, dispatch_uid=f"reference-data-save-{_model._meta.label}")
+    post_delete.connect(invalidate_reference_payload, sender=_model, dispatch_uid=f"reference-data-delete-{_model._meta.label}")
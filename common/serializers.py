@@ -46,9 +46,12 @@ class HotelDailyBaseRateSerializer(serializers.ModelSerializer):
 
 
 class MileageRateSerializer(serializers.ModelSerializer):
+    # The company code column was renamed from title to value; the API keeps the old name.
+    title = serializers.CharField(source='value', read_only=True)
+
     class Meta:
         model = MileageRate
-        fields = ['id', 'rate', 'title']
+        fields = ['id', 'rate', 'title', 'effective_from', 'effective_to']
         
 class ExchangeRateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,3 +1,64 @@
+import random
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from users.models import User
+from .fx import CENT, RateSnapshot
+from .models import Airline
+from .reference_data import reference_versions
+
+
+class ReferenceDataQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reference_versions.clear()
+        Airline.objects.create(value="Air Canada")
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(email="reference@example.com", first_name="Test", last_name="User", is_active=True))
+
+    def get_airlines(self):
+        response = self.client.get("/api/common/airlines")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_cached_reference_list_costs_no_queries(self):
+        self.get_airlines()
+        with self.assertNumQueries(0):
+            response = self.get_airlines()
+        self.assertEqual([airline["value"] for airline in response.json()], ["Air Canada"])
+
+    def test_write_is_seen_without_waiting_for_the_ttl(self):
+        etag = self.get_airlines()["ETag"]
+        Airline.objects.create(value="WestJet")
+        response = self.get_airlines()
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(sorted(airline["value"] for airline in response.json()), ["Air Canada", "WestJet"])
+
+
+class ConvertManyTests(TestCase):
+    rates = {"USD": Decimal("1"), "CAD": Decimal("1.371250"), "EUR": Decimal("0.921347"), "JPY": Decimal("151.369000")}
+
+    def assertMatchesDecimal(self, snapshot, amounts, pairs):
+        from_currencies = [pair[0] for pair in pairs]
+        to_currencies = [pair[1] for pair in pairs]
+        expected = [(amount * snapshot.get_rate(*pair)).quantize(CENT) for amount, pair in zip(amounts, pairs)]
+        self.assertEqual(snapshot.convert_many(amounts, from_currencies, to_currencies), expected)
+
+    def test_vectorised_conversion_matches_decimal(self):
+        snapshot = RateSnapshot(self.rates)
+        generator = random.Random(1234)
+        currencies = list(self.rates)
+        amounts, pairs = [], []
+        for exponent in range(15):
+            for _ in range(2000):
+                amounts.append(Decimal(generator.randrange(10 ** (exponent + 2))) * CENT)
+                pairs.append((generator.choice(currencies), generator.choice(currencies)))
+        self.assertMatchesDecimal(snapshot, amounts, pairs)
 
-# Create your tests here.
+    def test_half_cent_products_round_half_even(self):
+        snapshot = RateSnapshot({"USD": Decimal("1"), "XTS": Decimal("0.5")})
+        amounts = [Decimal("0.01"), Decimal("0.03"), Decimal("-0.05"), Decimal("123456789012.33")]
+        self.assertMatchesDecimal(snapshot, amounts, [("USD", "XTS")] * len(amounts))
@@ -1,11 +1,12 @@
 # common/urls.py
 
 from django.urls import path
-from .views import AirlineListView, ExchangeRateListView, RentalAgencyListView, CarTypeListView, MealCategoryListView, RelationshipToPAIListView, CityListView, HotelDailyBaseRateListView, MileageRateListView
+from .views import AirlineListView, BootstrapView, ExchangeRateConvertView, ExchangeRateListView, RentalAgencyListView, CarTypeListView, MealCategoryListView, RelationshipToPAIListView, CityListView, HotelDailyBaseRateListView, MileageRateListView
 
 app_name = 'common'
 
 urlpatterns = [
+    path('bootstrap', BootstrapView.as_view(), name='bootstrap'),
     path('airlines', AirlineListView.as_view(), name='airline-list'),
     path('rental-agencies', RentalAgencyListView.as_view(), name='rental-agency-list'),
     path('car-types', CarTypeListView.as_view(), name='car-type-list'),
@@ -15,4 +16,5 @@ urlpatterns = [
     path('hotel-daily-base-rates', HotelDailyBaseRateListView.as_view(), name='hotel-daily-base-rate-list'),
     path('mileage-rates', MileageRateListView.as_view(), name='mileage-rate-list'),
     path('exchange-rates', ExchangeRateListView.as_view(), name='exchange-rates'),
+    path('exchange-rates/convert', ExchangeRateConvertView.as_view(), name='exchange-rates-convert'),
 ]
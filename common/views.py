@@ -1,42 +1,100 @@
 # common/views.py
-import datetime
-import time
-import requests
+from decimal import Decimal
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
 from rest_framework import generics, status
 from rest_framework.response import Response
 from .models import Airline, ExchangeRate, RentalAgency, CarType, MealCategory, RelationshipToPAI, City, HotelDailyBaseRate, MileageRate
 from .serializers import AirlineSerializer, ExchangeRateSerializer, RentalAgencySerializer, CarTypeSerializer, MealCategorySerializer, RelationshipToPAISerializer, CitySerializer, HotelDailyBaseRateSerializer, MileageRateSerializer
-from django.utils import timezone
+from .exchange_rates import rates_are_stale, refresh_exchange_rates, refresh_in_background
+from .fx import MAX_AMOUNT, fx, is_convertible
+from .reference_data import get_bootstrap_bundle, get_payload
 
-class AirlineListView(generics.ListAPIView):
+
+class ReferenceDataListView(generics.ListAPIView):
+    """Serves a whole reference table from its cached JSON payload.
+
+    Clients revalidate with If-None-Match and get a 304 while the table is unchanged.
+    A request with ?v=<etag> names an exact version and may be cached indefinitely.
+    """
+
+    def list(self, request, *args, **kwargs):
+        payload = get_payload(self.queryset.model)
+        if request.query_params.get('v') == payload.etag.strip('"'):
+            cache_control = {'private': True, 'max_age': 31536000, 'immutable': True}
+        else:
+            cache_control = {'private': True, 'max_age': int(getattr(settings, 'REFERENCE_DATA_MAX_AGE', 86400))}
+
+        if payload.etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(payload.body, content_type='application/json')
+        response['ETag'] = payload.etag
+        patch_cache_control(response, **cache_control)
+        return response
+
+
+class BootstrapView(generics.GenericAPIView):
+    """Everything the client loads on startup in one document: the reference tables and current exchange rates.
+
+    The ETag is the bundle's version token, so a client that sends it back in If-None-Match
+    skips the download entirely when nothing changed. The version follows the reference
+    tables' database counters within REFERENCE_VERSION_TTL, and the FX snapshot within FX_SNAPSHOT_TTL.
+    """
+
+    def get(self, request, *args, **kwargs):
+        snapshot = fx.snapshot()
+        if not snapshot:
+            refresh_exchange_rates()
+            snapshot = fx.snapshot()
+        elif rates_are_stale() and getattr(settings, 'EXCHANGE_RATE_REFRESH_ON_READ', True):
+            refresh_in_background()
+
+        bundle = get_bootstrap_bundle(snapshot)
+        if bundle.etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = HttpResponse(bundle.gzipped, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(bundle.body, content_type='application/json')
+        response['ETag'] = bundle.etag
+        response['Vary'] = 'Accept-Encoding'
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class AirlineListView(ReferenceDataListView):
     queryset = Airline.objects.all()
     serializer_class = AirlineSerializer
 
-class RentalAgencyListView(generics.ListAPIView):
+class RentalAgencyListView(ReferenceDataListView):
     queryset = RentalAgency.objects.all()
     serializer_class = RentalAgencySerializer
 
-class CarTypeListView(generics.ListAPIView):
+class CarTypeListView(ReferenceDataListView):
     queryset = CarType.objects.all()
     serializer_class = CarTypeSerializer
 
-class MealCategoryListView(generics.ListAPIView):
+class MealCategoryListView(ReferenceDataListView):
     queryset = MealCategory.objects.all()
     serializer_class = MealCategorySerializer
 
-class RelationshipToPAIListView(generics.ListAPIView):
+class RelationshipToPAIListView(ReferenceDataListView):
     queryset = RelationshipToPAI.objects.all()
     serializer_class = RelationshipToPAISerializer
 
-class CityListView(generics.ListAPIView):
+class CityListView(ReferenceDataListView):
     queryset = City.objects.all()
     serializer_class = CitySerializer
 
-class HotelDailyBaseRateListView(generics.ListAPIView):
+class HotelDailyBaseRateListView(ReferenceDataListView):
     queryset = HotelDailyBaseRate.objects.all()
     serializer_class = HotelDailyBaseRateSerializer
 
-class MileageRateListView(generics.ListAPIView):
+class MileageRateListView(ReferenceDataListView):
     queryset = MileageRate.objects.all()
     serializer_class = MileageRateSerializer
     
@@ -51,83 +109,93 @@ class ExchangeRateListView(generics.ListAPIView):
 
     def list(self, request, *args, **kwargs):
         base_currency = request.query_params.get('base', 'USD').upper()
-        latest_rate = ExchangeRate.objects.order_by('-date_fetched').first()
-
-        if not latest_rate or timezone.now() >= latest_rate.next_update_time:
-            self.update_exchange_rates()
+        rate_date = request.query_params.get('date')
+        if rate_date:
+            parsed_date = parse_date(rate_date)
+            if parsed_date is None:
+                return Response({"result": "error", "message": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+            snapshot = fx.snapshot_for(parsed_date)
+        else:
+            snapshot = fx.snapshot()
 
-        latest_rate = ExchangeRate.objects.order_by('-date_fetched').first()
-        
-        queryset = ExchangeRate.objects.filter(date_fetched=latest_rate.date_fetched) if latest_rate else ExchangeRate.objects.none()
+        if not snapshot:
+            # Nothing to serve yet, so the first request has to wait for a fetch.
+            refresh_exchange_rates()
+            snapshot = fx.snapshot()
+        elif rates_are_stale() and getattr(settings, 'EXCHANGE_RATE_REFRESH_ON_READ', True):
+            # Serve the stale rates while a background thread fetches new ones.
+            refresh_in_background()
 
-        if not queryset.exists():
+        if not snapshot:
             return Response(
                 {"result": "error", "message": "No exchange rate data available"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
         if base_currency != 'USD':
-            base_rate_obj = queryset.filter(target_currency=base_currency).first()
-            if not base_rate_obj:
+            conversion_rates = snapshot.cross_rates(base_currency)
+            if conversion_rates is None:
                 return Response(
                     {"result": "error", "message": f"Base currency {base_currency} not found"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            usd_to_base_rate = base_rate_obj.rate
-            conversion_rates = {rate.target_currency: rate.rate / usd_to_base_rate for rate in queryset}
         else:
-            conversion_rates = {rate.target_currency: rate.rate for rate in queryset}
+            conversion_rates = dict(snapshot.rates)
 
         return Response(conversion_rates, status=status.HTTP_200_OK)
 
 
-    def update_exchange_rates(self):
-        """Fetch latest exchange rates and update the database."""
-        try:
-            data = self.fetch_exchange_rates()
-            
-            if not data:
-                print("Failed to fetch exchange rates after multiple attempts.")
-                return
-            
-            conversion_rates = data['rates']
-            last_update_time = timezone.now()
-            next_update_time = timezone.make_aware(
-                datetime.datetime.utcfromtimestamp(data['time_next_update_unix'])
-            )
-
-            for target_currency, rate in conversion_rates.items():
-                ExchangeRate.objects.update_or_create(
-                    target_currency=target_currency,
-                    defaults={
-                        'rate': rate,
-                        'date_fetched': last_update_time,
-                        'next_update_time': next_update_time
-                    }
-                )
-
-        except Exception as e:
-            print(f"Unexpected error updating exchange rates: {e}")
+class ExchangeRateConvertView(generics.GenericAPIView):
+    """Convert many (amount, from, to) rows against one rate snapshot in a single pass."""
 
+    def post(self, request, *args, **kwargs):
+        conversions = request.data.get('conversions')
+        if not isinstance(conversions, list) or not conversions:
+            return Response({"result": "error", "message": "conversions must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
 
-    def fetch_exchange_rates(self, max_retries=3, backoff_factor=1):
-        url = 'https://open.er-api.com/v6/latest/USD'
-        timeout = 5
+        max_rows = getattr(settings, 'EXCHANGE_RATE_CONVERT_MAX', 10000)
+        if len(conversions) > max_rows:
+            return Response({"result": "error", "message": f"At most {max_rows} conversions per request"}, status=status.HTTP_400_BAD_REQUEST)
 
-        for attempt in range(max_retries):
+        amounts, from_currencies, to_currencies = [], [], []
+        for index, conversion in enumerate(conversions):
+            if isinstance(conversion, dict):
+                conversion = (conversion.get('amount'), conversion.get('from'), conversion.get('to'))
             try:
-                response = requests.get(url, timeout=timeout)
-                response.raise_for_status()
-                return response.json()
-
-            except requests.exceptions.RequestException as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-
-                if attempt < max_retries - 1:
-                    wait_time = backoff_factor ** attempt
-                    print(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    print("Max retries reached. Giving up.")
-                    return None
-
+                amount, from_currency, to_currency = conversion
+                amount = Decimal(str(amount))
+            except (TypeError, ValueError, ArithmeticError):
+                return Response(
+                    {"result": "error", "message": f"Conversion {index} must be {{amount, from, to}} with a numeric amount"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not is_convertible(amount):
+                return Response(
+                    {"result": "error", "message": f"Conversion {index} amount must be a finite number below {MAX_AMOUNT:f} in magnitude"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            amounts.append(amount)
+            from_currencies.append(str(from_currency or '').upper())
+            to_currencies.append(str(to_currency or '').upper())
+
+        rate_date = request.data.get('date')
+        if rate_date:
+            parsed_date = parse_date(str(rate_date))
+            if parsed_date is None:
+                return Response({"result": "error", "message": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+            snapshot = fx.snapshot_for(parsed_date)
+        else:
+            snapshot = fx.snapshot()
+
+        converted = snapshot.convert_many(amounts, from_currencies, to_currencies)
+        results = [
+            {"amount": str(amount), "from": from_currency, "to": to_currency, "converted_amount": str(converted_amount) if converted_amount is not None else None}
+            for amount, from_currency, to_currency, converted_amount in zip(amounts, from_currencies, to_currencies, converted)
+        ]
+        missing = sum(1 for converted_amount in converted if converted_amount is None)
+        return Response({
+            "result": "success",
+            "date_fetched": snapshot.date_fetched,
+            "missing": missing,
+            "results": results,
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,274 @@
+# bulk.py
+import logging
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from common.models import Airline, CarType, City, MealCategory, RelationshipToPAI, RentalAgency
+from common.fx import fx
+from common.policy_rates import policy_rates
+from common.reference_data import reference_index
+from .models import CENT, ExpenseItem, ExpenseReceipt
+from .serializers import ExpenseItemSerializer
+from .utils import bulk_create_with_pks
+
+logger = logging.getLogger(__name__)
+
+BULK_OPERATIONS = ("create", "update", "delete")
+
+LOOKUP_MODELS = {
+    "airline": Airline,
+    "rental_agency": RentalAgency,
+    "car_type": CarType,
+    "meal_category": MealCategory,
+    "relationship_to_pai": RelationshipToPAI,
+    "city": City,
+}
+
+
+def get_bulk_max_operations():
+    return int(getattr(settings, "EXPENSE_ITEM_BULK_MAX_OPERATIONS", 500))
+
+
+class BulkRow:
+    def __init__(self, index, op, item_id=None, data=None):
+        self.index = index
+        self.op = op
+        self.item_id = item_id
+        self.data = data or {}
+        self.instance = None
+        self.validated_data = None
+        self.errors = None
+
+    def result(self, status=None):
+        result = {"index": self.index, "op": self.op, "id": self.item_id}
+        if self.errors is not None:
+            result["errors"] = self.errors
+        elif status:
+            result["status"] = status
+        return result
+
+
+class ExpenseItemBulkWriter:
+    """Validates a batch of item creates, updates and deletes for one report and applies them together.
+
+    Each distinct lookup value and exchange rate is resolved once for the whole batch; rows
+    are written with bulk_create/bulk_update in one transaction and report_amount is
+    adjusted once at the end.
+    Nothing is written unless every row validates.
+    """
+
+    def __init__(self, report, user, context=None):
+        self.report = report
+        self.user = user
+        self.context = context or {}
+        self._rates = {}
+        self._snapshots = {}
+        self._policy_rates = None
+        self._lookups = {}
+
+    def parse(self, operations):
+        rows = []
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                row = BulkRow(index, None)
+                row.errors = ["Each operation must be an object."]
+                rows.append(row)
+                continue
+
+            op = operation.get("op")
+            row = BulkRow(index, op, operation.get("id"), operation.get("data"))
+            if op not in BULK_OPERATIONS:
+                row.errors = [f'Invalid op "{op}". Expected one of: {", ".join(BULK_OPERATIONS)}.']
+            elif op != "create" and not row.item_id:
+                row.errors = [f'"id" is required for {op}.']
+            elif op != "delete" and not isinstance(row.data, dict):
+                row.errors = ['"data" must be an object.']
+            rows.append(row)
+        return rows
+
+    def validate(self, rows):
+        item_ids = [row.item_id for row in rows if row.op in ("update", "delete") and row.errors is None]
+        existing = {
+            str(item.item_id): item
+            for item in ExpenseItem.objects.filter(report=self.report, item_id__in=item_ids).select_related("city").prefetch_related("receipts")
+        } if item_ids else {}
+
+        seen = set()
+        for row in rows:
+            if row.errors is not None or row.op == "create":
+                continue
+            row.instance = existing.get(str(row.item_id))
+            if row.instance is None:
+                row.errors = [f'Expense item "{row.item_id}" not found in this report.']
+            elif str(row.item_id) in seen:
+                row.errors = [f'Expense item "{row.item_id}" appears more than once in this batch.']
+            seen.add(str(row.item_id))
+
+        for row in rows:
+            if row.errors is not None or row.op == "delete":
+                continue
+            if row.op == "create":
+                serializer = ExpenseItemSerializer(data=row.data, context=self.context)
+            else:
+                serializer = ExpenseItemSerializer(row.instance, data=row.data, partial=True, context=self.context)
+            if serializer.is_valid():
+                row.validated_data = dict(serializer.validated_data)
+            else:
+                row.errors = serializer.errors
+
+        self._load_snapshots(rows)
+        self._load_lookups(rows)
+        self._policy_rates = policy_rates.compiled()
+        for row in rows:
+            if row.errors is None and row.op != "delete":
+                try:
+                    self._resolve(row)
+                except ValidationError as e:
+                    row.errors = e.detail
+
+        return all(row.errors is None for row in rows)
+
+    def _load_snapshots(self, rows):
+        dates = set()
+        for row in rows:
+            if row.instance is not None:
+                dates.add(row.instance.expense_date)
+            if row.validated_data is not None:
+                dates.add(row.validated_data.get("expense_date", row.instance.expense_date if row.instance else None))
+        self._snapshots = fx.snapshots_for(dates)
+
+    def _load_lookups(self, rows):
+        # Each distinct value is resolved once for the batch, however many rows name it.
+        for field, model in LOOKUP_MODELS.items():
+            values = {row.validated_data.get(field) for row in rows if row.validated_data is not None}
+            values.discard(None)
+            self._lookups[field] = reference_index.get_many(model, values) if values else {}
+
+    def _get_instance(self, field, value):
+        if value is None:
+            return None
+        instance = self._lookups[field].get(value)
+        if instance is None:
+            raise ValidationError(f'Invalid input: {LOOKUP_MODELS[field].__name__} with value "{value}" does not exist.')
+        return instance
+
+    def _get_hotel_base_rate(self, city, on=None):
+        return self._policy_rates.hotel_rate(city, on=on)
+
+    def _get_mileage_rate(self, on=None):
+        return self._policy_rates.mileage_rate(getattr(self.user, "company_code", None), on=on)
+
+    def _get_exchange_rate(self, from_currency, on=None):
+        from_currency = (from_currency or "").upper()
+        if (from_currency, on) not in self._rates:
+            snapshot = self._snapshots.get(on) or fx.snapshot_for(on)
+            rate = snapshot.get_rate(from_currency, self.report.report_currency)
+            if rate is None:
+                raise ValidationError(f"Exchange rate for {from_currency} to {self.report.report_currency} does not exist.")
+            self._rates[from_currency, on] = rate
+        return self._rates[from_currency, on]
+
+    def _resolve(self, row):
+        data = row.validated_data
+        instance = row.instance
+        data.pop("report", None)
+        data.pop("hotel_daily_base_rate", None)
+        data.pop("mileage_rate", None)
+
+        city = data.get("city")
+        for field in LOOKUP_MODELS:
+            resolved = self._get_instance(field, data.pop(field, None))
+            if resolved is not None or instance is None:
+                data[field] = resolved
+
+        expense_type = data.get("expense_type") or (instance.expense_type if instance else None)
+        expense_date = data.get("expense_date", instance.expense_date if instance else None)
+        data["mileage_rate"] = self._get_mileage_rate(on=expense_date) if expense_type == "Mileage" else None
+        if city is None and instance is not None and instance.city:
+            city = instance.city.value
+        data["hotel_daily_base_rate"] = self._get_hotel_base_rate(city, on=expense_date) if expense_type == "Hotel" else None
+
+        if data.get("receipt_currency"):
+            data["receipt_currency"] = data["receipt_currency"].upper()
+        receipt_currency = data.get("receipt_currency") or instance.receipt_currency
+        self._get_exchange_rate(receipt_currency, data.get("expense_date", instance.expense_date if instance else None))
+        if instance is not None:
+            self._get_exchange_rate(instance.receipt_currency, instance.expense_date)
+
+    def _stored_converted_amount(self, item):
+        if item.converted_amount is not None:
+            return item.converted_amount
+        return (Decimal(item.receipt_amount) * self._get_exchange_rate(item.receipt_currency, item.expense_date)).quantize(CENT)
+
+    def _convert(self, item):
+        return item.apply_conversion(self._get_exchange_rate(item.receipt_currency, item.expense_date)) or Decimal(0)
+
+    def write(self, rows):
+        now = timezone.now()
+        epoch_timestamp = int(time.time())
+        delta = Decimal(0)
+        created, updated, deleted = [], [], []
+        new_receipts = []
+        stale_receipt_ids = []
+        update_fields = set()
+
+        for row in rows:
+            if row.op == "delete":
+                delta -= self._stored_converted_amount(row.instance)
+                deleted.append(row.instance.pk)
+            elif row.op == "create":
+                receipts_data = row.validated_data.pop("receipts", [])
+                item = ExpenseItem(report=self.report, **row.validated_data)
+                row.instance = item
+                row.item_id = str(item.item_id)
+                delta += self._convert(item)
+                created.append(item)
+                new_receipts.extend(self._new_receipts(item, receipts_data, epoch_timestamp))
+            else:
+                item = row.instance
+                old_converted_amount = self._stored_converted_amount(item)
+                old_amount = (item.receipt_amount, item.receipt_currency, item.expense_date)
+                receipts_data = row.validated_data.pop("receipts", None)
+                for field, value in row.validated_data.items():
+                    setattr(item, field, value)
+                    update_fields.add(field)
+                item.updated_at = now
+                if (item.receipt_amount, item.receipt_currency, item.expense_date) != old_amount or item.converted_amount is None:
+                    self._convert(item)
+                    update_fields.update(("amount", "conversion_rate", "exchange_rate", "converted_amount"))
+                delta += item.converted_amount - old_converted_amount
+                updated.append(item)
+                if receipts_data is not None:
+                    keep_receipts = {receipt["s3_path"] for receipt in receipts_data if "s3_path" in receipt}
+                    stale_receipt_ids.extend(r.pk for r in item.receipts.all() if r.s3_path not in keep_receipts)
+                    new_receipts.extend(self._new_receipts(item, receipts_data, epoch_timestamp))
+
+        with transaction.atomic():
+            if deleted:
+                ExpenseItem.objects.filter(pk__in=deleted).delete()
+            if created:
+                bulk_create_with_pks(ExpenseItem, created, "item_id")
+            if updated:
+                ExpenseItem.objects.bulk_update(updated, sorted(update_fields | {"updated_at"}))
+            if stale_receipt_ids:
+                ExpenseReceipt.objects.filter(pk__in=stale_receipt_ids).delete()
+            if new_receipts:
+                ExpenseReceipt.objects.bulk_create(new_receipts)
+            self.report.apply_amount_delta(delta)
+
+        logger.info(f"Bulk item write on report {self.report.report_id}: {len(created)} created, {len(updated)} updated, {len(deleted)} deleted")
+        return created + updated
+
+    def _new_receipts(self, item, receipts_data, epoch_timestamp):
+        return [
+            ExpenseReceipt(
+                expense_item=item,
+                s3_path=ExpenseReceipt.build_s3_path(self.report.report_id, item.item_id, receipt["upload_filename"], epoch_timestamp),
+            )
+            for receipt in receipts_data
+            if receipt.get("upload_filename")
+        ]
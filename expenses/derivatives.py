@@ -0,0 +1,137 @@
+# derivatives.py
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+
+from .imaging import render_derivatives
+from .models import ExpenseReceipt
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+DERIVATIVE_KINDS = ("thumbnail", "preview")
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="receipt-derivatives")
+
+
+def get_process_pool():
+    """Process pool for the CPU-bound resizing, created on first use.
+
+    Workers are spawned rather than forked so they don't inherit the web worker's threads
+    or database connections; they only import expenses.imaging.
+    """
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                workers = getattr(settings, "RECEIPT_DERIVATIVE_WORKERS", None) or os.cpu_count() or 2
+                _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def derivative_path(s3_path, kind):
+    # Kept under the original's <report_id>/<item_id>/ prefix so cleanup treats them together.
+    return f"{s3_path}.{kind}.jpg"
+
+
+def is_image(receipt):
+    if receipt.content_type:
+        return receipt.content_type.startswith("image/")
+    return (receipt.s3_path or "").lower().endswith(IMAGE_EXTENSIONS)
+
+
+def pending_receipts(receipt_ids=None):
+    # thumbnail_path is NULL until processed and '' when the original can't be rendered.
+    queryset = ExpenseReceipt.objects.filter(thumbnail_path__isnull=True, s3_path__isnull=False).exclude(s3_path="").order_by("pk")
+    if receipt_ids is not None:
+        queryset = queryset.filter(pk__in=receipt_ids)
+    return queryset
+
+
+def download_original(s3_path):
+    max_bytes = int(getattr(settings, "RECEIPT_DERIVATIVE_MAX_BYTES", 25 * 1024 * 1024))
+    try:
+        size, _, chunks = get_storage().stream(s3_path)
+        if (size or 0) > max_bytes:
+            logger.warning(f"Skipping derivatives for {s3_path}: {size} bytes")
+            return b""
+        return b"".join(chunks)
+    except Exception as e:
+        logger.warning(f"Failed to download {s3_path} for derivatives: {e}")
+        return None
+
+
+def upload_derivative(s3_path, data):
+    try:
+        get_storage().put(s3_path, data, content_type="image/jpeg", cache_control="private, max-age=86400")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to upload derivative {s3_path}: {e}")
+        return False
+
+
+def generate_derivatives(receipts, io_workers=8):
+    """Make thumbnails and previews for `receipts`. Returns the number of receipts updated.
+
+    Originals are downloaded and results uploaded on a thread pool; resizing runs in the
+    process pool. Receipts whose original fails to download or upload stay pending.
+    """
+    receipts = list(receipts)
+    for receipt in receipts:
+        if not is_image(receipt):
+            receipt.thumbnail_path = receipt.preview_path = ""
+
+    images = [receipt for receipt in receipts if receipt.thumbnail_path is None]
+    done = [receipt for receipt in receipts if receipt.thumbnail_path == ""]
+    if images:
+        process_pool = get_process_pool()
+        with ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+            originals = list(io_pool.map(download_original, [receipt.s3_path for receipt in images]))
+            rendering = [
+                process_pool.submit(render_derivatives, data) if data else None
+                for data in originals
+            ]
+
+            uploads = []
+            for receipt, data, future in zip(images, originals, rendering):
+                if data is None:
+                    continue
+                rendered = future.result() if future else {}
+                if not rendered:
+                    receipt.thumbnail_path = receipt.preview_path = ""
+                    done.append(receipt)
+                    continue
+                paths = {kind: derivative_path(receipt.s3_path, kind) for kind in DERIVATIVE_KINDS}
+                uploads.append((receipt, paths, [io_pool.submit(upload_derivative, paths[kind], rendered[kind]) for kind in DERIVATIVE_KINDS]))
+
+            for receipt, paths, futures in uploads:
+                if all(future.result() for future in futures):
+                    receipt.thumbnail_path = paths["thumbnail"]
+                    receipt.preview_path = paths["preview"]
+                    done.append(receipt)
+
+    if done:
+        ExpenseReceipt.objects.bulk_update(done, ["thumbnail_path", "preview_path"])
+    return len(done)
+
+
+def _generate_and_close(receipt_ids):
+    try:
+        generate_derivatives(pending_receipts(receipt_ids))
+    except Exception as e:
+        logger.error(f"Failed to generate receipt derivatives for {receipt_ids}: {e}")
+    finally:
+        connection.close()
+
+
+def schedule_derivatives(receipt_ids):
+    """Queue derivative generation off the request path; the management command catches anything missed."""
+    if receipt_ids and getattr(settings, "RECEIPT_DERIVATIVES_ON_UPLOAD", True):
+        _dispatcher.submit(_generate_and_close, list(receipt_ids))
@@ -1,16 +1,24 @@
 import logging
+import os
 from django.shortcuts import get_object_or_404
 from rest_framework.exceptions import ValidationError
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse
 from rest_framework import generics, status
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from django.conf import settings
-from common.models import ExchangeRate
-from expenses.utils import delete_s3_file, generate_presigned_url
-from .models import ExpenseItem, ExpenseReport
-from .serializers import ExpenseItemSerializer, ExpenseReceiptSerializer
+from django.db import transaction
+from common.fx import fx
+from expenses.bulk import ExpenseItemBulkWriter, get_bulk_max_operations
+from expenses.receipt_cleanup import flush_pending_deletes
+from expenses.uploads import (
+    UploadError, abort_multipart_upload, check_key, complete_receipt_uploads, list_uploaded_parts,
+    presign_upload_parts, start_multipart_upload,
+)
+from expenses.storage import LocalReceiptStorage, StorageError, get_storage
+from .models import ExpenseItem, ExpenseReceipt, ExpenseReport
+from .pagination import ExpenseItemCursorPagination
+from .serializers import ExpenseItemSerializer, ExpenseReceiptSerializer, ReportReceiptSerializer
 from decimal import Decimal
 from rest_framework.response import Response
 
@@ -19,12 +27,13 @@ logger = logging.getLogger(__name__)
 class ExpenseItemListCreateView(generics.ListCreateAPIView):
     serializer_class = ExpenseItemSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ExpenseItemCursorPagination
 
     def get_queryset(self):
         report_id = self.kwargs['report_id']
         if self.request.user.is_staff or self.request.user.is_superuser:
-            return ExpenseItem.objects.filter(report__report_id=report_id)
-        return ExpenseItem.objects.filter(report__report_id=report_id, report__user=self.request.user)
+            return ExpenseItem.objects.filter(report__report_id=report_id).with_lookups()
+        return ExpenseItem.objects.filter(report__report_id=report_id, report__user=self.request.user).with_lookups()
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -70,8 +79,8 @@ class ExpenseItemDetailView(generics.RetrieveUpdateDestroyAPIView):
         """Retrieve expense items based on user permissions."""
         report_id = self.kwargs['report_id']
         if self.request.user.is_staff or self.request.user.is_superuser:
-            return ExpenseItem.objects.filter(report__report_id=report_id)
-        return ExpenseItem.objects.filter(report__report_id=report_id, report__user=self.request.user)
+            return ExpenseItem.objects.filter(report__report_id=report_id).with_lookups()
+        return ExpenseItem.objects.filter(report__report_id=report_id, report__user=self.request.user).with_lookups()
 
     def get_serializer_context(self):
         """Modify serializer context to include presigned URL for PUT and PATCH."""
@@ -88,33 +97,63 @@ class ExpenseItemDetailView(generics.RetrieveUpdateDestroyAPIView):
         if not report:
             return Response({"result": "error", "message": "Associated report not found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        old_receipt_amount = Decimal(instance.receipt_amount)
-        old_receipt_currency = instance.receipt_currency
-
-        old_rate = self.get_exchange_rate(old_receipt_currency, report.report_currency)
-        if old_rate is None:
-            old_rate = Decimal(1)
-
-        old_converted_amount = old_receipt_amount * old_rate
-        report.report_amount -= old_converted_amount
-        report.save()
-
-        self.perform_destroy(instance)
+        old_converted_amount = instance.converted_amount
+        if old_converted_amount is None:
+            old_rate = self.get_exchange_rate(instance.receipt_currency, report.report_currency, on=instance.expense_date)
+            if old_rate is None:
+                old_rate = Decimal(1)
+            old_converted_amount = Decimal(instance.receipt_amount) * old_rate
+        with transaction.atomic():
+            report.apply_amount_delta(-old_converted_amount)
+            self.perform_destroy(instance)
 
         return Response({"result": "success", "message": "Expense item deleted and report updated."}, status=status.HTTP_204_NO_CONTENT)
     
-    def get_exchange_rate(self, from_currency, to_currency):
-        if from_currency == to_currency:
-            return Decimal(1)
-        try:
-            latest_rate = ExchangeRate.objects.latest('date_fetched')
-            from_rate = ExchangeRate.objects.get(target_currency=from_currency, date_fetched=latest_rate.date_fetched).rate
-            to_rate = ExchangeRate.objects.get(target_currency=to_currency, date_fetched=latest_rate.date_fetched).rate
-            return to_rate / from_rate
-        except ExchangeRate.DoesNotExist:
+    def get_exchange_rate(self, from_currency, to_currency, on=None):
+        rate = fx.get_rate(from_currency, to_currency, on=on)
+        if rate is None:
             raise ValidationError(f'Exchange rate for {from_currency} to {to_currency} does not exist.')
+        return rate
+
+
+class ExpenseItemBulkView(generics.GenericAPIView):
+    serializer_class = ExpenseItemSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['include_presigned_url'] = True
+        return context
+
+    def post(self, request, report_id, *args, **kwargs):
+        """Apply a list of {op: create|update|delete, id, data} operations to the report's items."""
+        report = get_object_or_404(ExpenseReport, report_id=report_id, user=request.user)
+        operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+        if not isinstance(operations, list) or not operations:
+            return Response({"result": "error", "message": "Expected a non-empty list of operations."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > get_bulk_max_operations():
+            return Response({"result": "error", "message": f"At most {get_bulk_max_operations()} operations are allowed per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        writer = ExpenseItemBulkWriter(report, request.user, context=self.get_serializer_context())
+        rows = writer.parse(operations)
+        if not writer.validate(rows):
+            return Response({"result": "error", "results": [row.result() for row in rows]}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = writer.write(rows)
+        items = ExpenseItem.objects.filter(pk__in=[item.pk for item in items]).with_lookups()
+        data = {str(item['id']): item for item in self.get_serializer(items, many=True).data}
+
+        results = []
+        for row in rows:
+            result = row.result(status={'create': 'created', 'update': 'updated', 'delete': 'deleted'}[row.op])
+            if row.op != 'delete':
+                result['item'] = data.get(str(row.item_id))
+            results.append(result)
+
+        report.refresh_from_db(fields=['report_amount'])
+        return Response({"result": "success", "report_amount": report.report_amount, "results": results}, status=status.HTTP_200_OK)
+
 
-    
 class ExpenseItemFileDownloadView(generics.ListAPIView):
     serializer_class = ExpenseReceiptSerializer
     permission_classes = [IsAuthenticated]
@@ -135,28 +174,214 @@ class ExpenseItemFileDownloadView(generics.ListAPIView):
             expense_item = get_object_or_404(ExpenseItem, report__report_id=report_id, item_id=item_id, report__user=self.request.user)
 
         return expense_item.receipts.all()
-        
+
+
+class ExpenseReportReceiptsView(generics.ListAPIView):
+    """Read URLs for every receipt in a report: one access check, one receipt query, signed together."""
+    serializer_class = ReportReceiptSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        report_id = self.kwargs.get('report_id')
+        if self.request.user.is_staff or self.request.user.is_superuser:
+            report = get_object_or_404(ExpenseReport, report_id=report_id)
+        else:
+            report = get_object_or_404(ExpenseReport, report_id=report_id, user=self.request.user)
+
+        return (
+            ExpenseReceipt.objects.filter(expense_item__report=report)
+            .select_related('expense_item')
+            .order_by('expense_item__created_at', 'expense_item__id', 'id')
+        )
+
+    def list(self, request, *args, **kwargs):
+        receipts = list(self.get_queryset())
+        context = self.get_serializer_context()
+        context['presigned_urls'] = get_storage().presigned_urls(
+            path for receipt in receipts for path in (receipt.s3_path, receipt.thumbnail_path, receipt.preview_path) if path
+        )
+        serializer = self.get_serializer_class()(receipts, many=True, context=context)
+        return Response({"report_id": str(self.kwargs.get('report_id')), "receipts": serializer.data}, status=status.HTTP_200_OK)
+
+
+class ExpenseItemUploadView(generics.GenericAPIView):
+    """Start (POST) or abort (DELETE) a multipart receipt upload straight to storage."""
+    serializer_class = ExpenseReceiptSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_item(self, report_id, item_id):
+        return get_object_or_404(ExpenseItem.objects.select_related('report'), report__report_id=report_id, item_id=item_id, report__user=self.request.user)
+
+    def post(self, request, report_id, item_id, *args, **kwargs):
+        item = self.get_item(report_id, item_id)
+        filename = os.path.basename(str(request.data.get('filename') or '').replace('\\', '/'))
+        if not filename:
+            return Response({"result": "error", "message": "filename is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(request.data['size']) if request.data.get('size') else None
+        except (TypeError, ValueError):
+            return Response({"result": "error", "message": "size must be an integer number of bytes."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            upload = start_multipart_upload(item, filename, request.data.get('content_type'), size)
+        except Exception as e:
+            logger.error(f'Failed to start upload for ExpenseItem {item_id}: {e}')
+            return Response({"result": "error", "message": "Failed to start upload."}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(upload, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, report_id, item_id, *args, **kwargs):
+        self.get_item(report_id, item_id)
+        s3_path = request.data.get('s3_path') or request.query_params.get('s3_path')
+        upload_id = request.data.get('upload_id') or request.query_params.get('upload_id')
+        try:
+            check_key(s3_path, report_id, item_id)
+            abort_multipart_upload(s3_path, upload_id)
+        except UploadError as e:
+            return Response({"result": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'Failed to abort upload {upload_id}: {e}')
+            return Response({"result": "error", "message": "Failed to abort upload."}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ExpenseItemUploadPartsView(ExpenseItemUploadView):
+    """List the parts already uploaded (GET) or sign URLs for more parts (POST), to resume an upload."""
+
+    def get(self, request, report_id, item_id, *args, **kwargs):
+        self.get_item(report_id, item_id)
+        s3_path = request.query_params.get('s3_path')
+        try:
+            check_key(s3_path, report_id, item_id)
+            parts = list_uploaded_parts(s3_path, request.query_params.get('upload_id'))
+        except UploadError as e:
+            return Response({"result": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'Failed to list parts for {s3_path}: {e}')
+            return Response({"result": "error", "message": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"s3_path": s3_path, "parts": parts}, status=status.HTTP_200_OK)
+
+    def post(self, request, report_id, item_id, *args, **kwargs):
+        self.get_item(report_id, item_id)
+        s3_path = request.data.get('s3_path')
+        part_numbers = request.data.get('part_numbers')
+        if not request.data.get('upload_id') or not isinstance(part_numbers, list) or not part_numbers:
+            return Response({"result": "error", "message": "upload_id and a non-empty part_numbers list are required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            check_key(s3_path, report_id, item_id)
+            parts = presign_upload_parts(s3_path, request.data['upload_id'], part_numbers)
+        except (UploadError, TypeError, ValueError) as e:
+            return Response({"result": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"s3_path": s3_path, "parts": parts}, status=status.HTTP_200_OK)
+
+
+class ExpenseReceiptCompleteView(generics.GenericAPIView):
+    """Complete uploads for a report and record size, content type and checksum of each object."""
+    serializer_class = ExpenseReceiptSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, report_id, *args, **kwargs):
+        report = get_object_or_404(ExpenseReport, report_id=report_id, user=request.user)
+        entries = request.data.get('receipts') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            return Response({"result": "error", "message": "Expected a non-empty list of receipts."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > get_bulk_max_operations():
+            return Response({"result": "error", "message": f"At most {get_bulk_max_operations()} receipts are allowed per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = complete_receipt_uploads(report, entries)
+        failed = any('error' in result for result in results)
+        return Response(
+            {"result": "error" if failed else "success", "results": results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK,
+        )
+
+
 class ExpenseItemFileDeleteView(generics.GenericAPIView):
     serializer_class = ExpenseItemSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'item_id'
 
     def delete(self, request, report_id, item_id, *args, **kwargs):
+        """Delete one receipt (?receipt_id= or ?s3_path=) or all receipts of the item, then purge the S3 objects."""
         try:
             if self.request.user.is_staff or self.request.user.is_superuser:
                 expense_item = ExpenseItem.objects.get(report__report_id=report_id, item_id=item_id)
             else:
                 expense_item = ExpenseItem.objects.get(report__report_id=report_id, item_id=item_id, report__user=request.user)
-            if expense_item.s3_path:
-                delete_s3_file(settings.AWS_S3_BUCKET_NAME, expense_item.s3_path)
-                expense_item.s3_path = None
-                expense_item.save()
-                return JsonResponse({'detail': 'File deleted successfully.'}, status=status.HTTP_200_OK)
-            else:
-                return JsonResponse({'detail': 'No file to delete.'}, status=status.HTTP_400_BAD_REQUEST)
         except ExpenseItem.DoesNotExist:
             logger.error(f'ExpenseItem with id {item_id} does not exist for user {request.user}')
             return JsonResponse({'error': 'Expense item not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        receipts = expense_item.receipts.all()
+        receipt_id = request.query_params.get('receipt_id') or request.data.get('receipt_id')
+        s3_path = request.query_params.get('s3_path') or request.data.get('s3_path')
+        if receipt_id:
+            try:
+                receipts = receipts.filter(pk=int(receipt_id))
+            except (TypeError, ValueError):
+                return JsonResponse({'detail': 'receipt_id must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        elif s3_path:
+            receipts = receipts.filter(s3_path=s3_path)
+
+        s3_paths = [path for paths in receipts.values_list('s3_path', 'thumbnail_path', 'preview_path') for path in paths if path]
+        if not s3_paths:
+            return JsonResponse({'detail': 'No file to delete.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Deleting the rows queues their objects in pending_s3_delete; flush just those once committed.
+            receipts.delete()
+            transaction.on_commit(lambda: self.flush(s3_paths))
+        return JsonResponse({'detail': 'File deleted successfully.'}, status=status.HTTP_200_OK)
+
+    def flush(self, s3_paths):
+        try:
+            flush_pending_deletes(s3_paths=s3_paths)
         except Exception as e:
-            logger.error(f'Failed to delete file for ExpenseItem with id {item_id}: {e}')
-            return JsonResponse({'error': 'Failed to delete file'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # The entries stay queued for the flush_receipt_deletes command.
+            logger.error(f'Failed to delete S3 files {s3_paths}: {e}')
+
+
+class ReceiptStorageObjectView(APIView):
+    """Serves the signed URLs of LocalReceiptStorage: GET downloads, PUT uploads an object or a multipart part.
+
+    The signed token is the only credential, as with an S3 presigned URL.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get_payload(self, token, operations):
+        storage = get_storage()
+        if not isinstance(storage, LocalReceiptStorage):
+            return storage, None
+        payload = storage.load_token(token)
+        if payload is None or payload.get('op') not in operations:
+            return storage, None
+        return storage, payload
+
+    def get(self, request, token):
+        storage, payload = self.get_payload(token, ('get_object',))
+        if payload is None:
+            return JsonResponse({'detail': 'Invalid or expired URL.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            path = storage.path(payload['key'])
+            return FileResponse(open(path, 'rb'), filename=os.path.basename(path))
+        except (OSError, StorageError):
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    def put(self, request, token):
+        storage, payload = self.get_payload(token, ('put_object', 'upload_part'))
+        if payload is None:
+            return JsonResponse({'detail': 'Invalid or expired URL.'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Read the raw body in chunks; request.stream is None for an empty body.
+        stream = request.stream
+        chunks = iter(lambda: stream.read(1024 * 1024), b'') if stream is not None else iter([b''])
+        try:
+            if payload['op'] == 'upload_part':
+                etag = storage.put_part(payload['key'], payload['upload_id'], payload['part_number'], chunks)
+            else:
+                etag = storage.write(storage.path(payload['key']), chunks)
+        except StorageError as e:
+            return JsonResponse({'detail': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
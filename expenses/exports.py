@@ -0,0 +1,129 @@
+# exports.py
+import csv
+import json
+from django.conf import settings
+
+from .models import ExpenseItem, ExpenseReport
+
+EXPORT_DATASETS = ("reports", "items")
+EXPORT_FORMATS = ("csv", "jsonl")
+
+REPORT_EXPORT_COLUMNS = {
+    "report_id": "report_id",
+    "report_number": "report_number",
+    "user_email": "user__email",
+    "employee_id": "user__employee_id",
+    "company_code": "user__company_code",
+    "org_id": "user__org_id",
+    "report_status": "report_status",
+    "report_date": "report_date",
+    "report_submit_date": "report_submit_date",
+    "expense_type": "expense_type",
+    "purpose": "purpose",
+    "payment_method": "payment_method",
+    "report_amount": "report_amount",
+    "report_currency": "report_currency",
+    "integration_status": "integration_status",
+    "integration_date": "integration_date",
+    "iexp_report_number": "iexp_report_number",
+    "iexp_report_status": "iexp_report_status",
+    "paid_amount": "paid_amount",
+    "created_at": "created_at",
+}
+
+ITEM_EXPORT_COLUMNS = {
+    "report_id": "report__report_id",
+    "report_number": "report__report_number",
+    "report_currency": "report__report_currency",
+    "user_email": "report__user__email",
+    "item_id": "item_id",
+    "expense_type": "expense_type",
+    "expense_date": "expense_date",
+    "receipt_amount": "receipt_amount",
+    "receipt_currency": "receipt_currency",
+    "amount": "amount",
+    "conversion_rate": "conversion_rate",
+    "converted_amount": "converted_amount",
+    "exchange_rate": "exchange_rate",
+    "payment_method": "payment_method",
+    "justification": "justification",
+    "note": "note",
+    "airline": "airline__value",
+    "origin_destination": "origin_destination",
+    "rental_agency": "rental_agency__value",
+    "car_type": "car_type__value",
+    "meal_category": "meal_category__value",
+    "employee_names": "employee_names",
+    "total_employees": "total_employees",
+    "company_customer_name_title": "company_customer_name_title",
+    "business_topic": "business_topic",
+    "total_attendees": "total_attendees",
+    "relationship_to_pai": "relationship_to_pai__value",
+    "name_of_establishment": "name_of_establishment",
+    "city": "city__value",
+    "hotel_name": "hotel_name",
+    "hotel_daily_base_rate": "hotel_daily_base_rate__amount",
+    "carrier": "carrier",
+    "distance": "distance",
+    "mileage_rate": "mileage_rate__rate",
+    "created_at": "created_at",
+}
+
+
+def get_export_chunk_size():
+    return int(getattr(settings, "EXPENSE_EXPORT_CHUNK_SIZE", 2000))
+
+
+def export_columns(dataset):
+    return REPORT_EXPORT_COLUMNS if dataset == "reports" else ITEM_EXPORT_COLUMNS
+
+
+def export_queryset(dataset, org_id=None, start_date=None, end_date=None):
+    """Filter reports (or items, by their report) on org and report creation date."""
+    if dataset == "reports":
+        queryset, prefix = ExpenseReport.objects.all(), ""
+    else:
+        queryset, prefix = ExpenseItem.objects.all(), "report__"
+
+    if org_id is not None:
+        queryset = queryset.filter(**{f"{prefix}user__org_id": org_id})
+    if start_date is not None:
+        queryset = queryset.filter(**{f"{prefix}created_at__date__gte": start_date})
+    if end_date is not None:
+        queryset = queryset.filter(**{f"{prefix}created_at__date__lte": end_date})
+    return queryset.order_by("pk")
+
+
+def iter_export_rows(dataset, org_id=None, start_date=None, end_date=None, chunk_size=None):
+    """Yield flat dict rows. Lookup names come from joins in the same SELECT, never per-row queries."""
+    columns = export_columns(dataset)
+    queryset = export_queryset(dataset, org_id, start_date, end_date).values_list(*columns.values())
+    names = list(columns)
+    for values in queryset.iterator(chunk_size=chunk_size or get_export_chunk_size()):
+        yield dict(zip(names, values))
+
+
+class Echo:
+    """File-like object whose write() returns the value, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([row[column] for column in columns])
+
+
+def render_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+def stream_export(dataset, file_format, **filters):
+    rows = iter_export_rows(dataset, **filters)
+    if file_format == "csv":
+        return render_csv(rows, list(export_columns(dataset)))
+    return render_jsonl(rows)
@@ -0,0 +1,36 @@
+# imaging.py
+# Pure image work for the receipt derivative pipeline. No Django imports, so worker
+# processes can import it without setting up the project.
+import io
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+THUMBNAIL_SIZE = (256, 256)
+PREVIEW_SIZE = (1600, 1600)
+THUMBNAIL_QUALITY = 70
+PREVIEW_QUALITY = 80
+
+# Guard against decompression bombs in user uploads (about 8000 x 8000 pixels).
+Image.MAX_IMAGE_PIXELS = 64_000_000
+
+
+def encode_jpeg(image, size, quality):
+    image = image.copy()
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def render_derivatives(data):
+    """Return {"thumbnail": bytes, "preview": bytes} as JPEGs, or {} if `data` isn't a readable image."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            return {
+                "thumbnail": encode_jpeg(image, THUMBNAIL_SIZE, THUMBNAIL_QUALITY),
+                "preview": encode_jpeg(image, PREVIEW_SIZE, PREVIEW_QUALITY),
+            }
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return {}
@@ -0,0 +1,311 @@
+# imports.py
+import csv
+import json
+import logging
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from common.fx import fx
+from common.policy_rates import policy_rates
+from common.models import Airline, CarType, City, MealCategory, RelationshipToPAI, RentalAgency
+from users.models import User
+from .models import ExpenseItem, ExpenseReport, ImportCheckpoint, parse_amount
+from .report_numbers import allocate_report_numbers, format_report_number
+from .utils import bulk_create_with_pks
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ("csv", "jsonl")
+
+LOOKUP_COLUMNS = {
+    "airline": Airline,
+    "rental_agency": RentalAgency,
+    "car_type": CarType,
+    "meal_category": MealCategory,
+    "relationship_to_pai": RelationshipToPAI,
+    "city": City,
+}
+
+REPORT_TEXT_COLUMNS = {
+    "purpose": "purpose",
+    "report_expense_type": "expense_type",
+    "report_payment_method": "payment_method",
+    "iexp_report_status": "iexp_report_status",
+    "paid_amount": "paid_amount",
+}
+
+ITEM_TEXT_COLUMNS = (
+    "justification", "note", "origin_destination", "employee_names", "employee_names2",
+    "company_customer_name_title", "business_topic", "name_of_establishment", "hotel_name",
+    "carrier", "distance", "attendee1", "attendee2", "attendee3", "attendee4", "attendee5",
+    "attendee6", "attendee7", "attendee8", "attendee9", "attendee10",
+)
+
+ITEM_INTEGER_COLUMNS = ("total_employees", "total_attendees")
+
+# ExpenseItem.amount is max_digits=14, decimal_places=2.
+MAX_RECEIPT_AMOUNT = Decimal("1e12")
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(path, file_format):
+    """Yield (line_number, row) pairs without loading the file into memory.
+
+    A JSONL line that isn't a JSON object is yielded as a RowError in place of the row,
+    so it is reported like any other bad row instead of aborting the import.
+    """
+    with open(path, newline="", encoding="utf-8") as source:
+        if file_format == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, RowError(f"Invalid JSON: {e.msg} at column {e.colno}")
+                    continue
+                yield line_number, row if isinstance(row, dict) else RowError("Expected a JSON object")
+
+
+class ExpenseImporter:
+    """Loads legacy iExpense rows (one row per item, report columns repeated) in batches.
+
+    Reports are keyed by iexp_report_number. Lookup values, users, policy rates and the
+    exchange rates effective on each expense_date are resolved from in-memory maps, and
+    report numbers are allocated one block per batch before its transaction opens. Every
+    batch is a single transaction that also advances the checkpoint row, so a resumed
+    import never inserts a committed batch twice.
+    """
+
+    def __init__(self, batch_size=1000, checkpoint_name=None, stdout=None):
+        self.batch_size = batch_size
+        self.checkpoint_name = checkpoint_name
+        self.stdout = stdout
+        self.lookups = {}
+        self.users = {}
+        self.company_codes = {}
+        self.city_names = {}
+        self.stats = {"rows": 0, "reports": 0, "items": 0, "errors": 0}
+
+    def load_reference_data(self):
+        for column, model in LOOKUP_COLUMNS.items():
+            self.lookups[column] = {}
+            for pk, value in model.objects.order_by("pk").values_list("pk", "value"):
+                self.lookups[column].setdefault(value.casefold(), pk)
+        self.city_names = {pk: value for value, pk in self.lookups["city"].items()}
+
+    def read_checkpoint(self):
+        if not self.checkpoint_name:
+            return 0
+        return ImportCheckpoint.objects.filter(name=self.checkpoint_name).values_list("rows_done", flat=True).first() or 0
+
+    def write_checkpoint(self, rows_done):
+        """Record progress; called inside the batch's transaction so it commits with the rows."""
+        if self.checkpoint_name:
+            ImportCheckpoint.objects.update_or_create(name=self.checkpoint_name, defaults={"rows_done": rows_done})
+
+    def run(self, path, file_format):
+        self.load_reference_data()
+        rows_done = self.read_checkpoint()
+        if rows_done:
+            self.log(f"[INFO] Resuming after {rows_done} rows")
+
+        batch = []
+        for index, (line_number, row) in enumerate(read_rows(path, file_format)):
+            if index < rows_done:
+                continue
+            batch.append((line_number, row))
+            if len(batch) >= self.batch_size:
+                rows_done += self.import_batch(batch, rows_done)
+                batch = []
+        if batch:
+            rows_done += self.import_batch(batch, rows_done)
+        return self.stats
+
+    def import_batch(self, batch, rows_done=0):
+        parsed = []
+        for line_number, row in batch:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                parsed.append(self.parse_row(row))
+            except RowError as e:
+                self.stats["errors"] += 1
+                self.log(f"[ERROR] Line {line_number}: {e}")
+
+        self.resolve_users(parsed)
+        valid = []
+        for report_data, item_data in parsed:
+            user_id = self.users.get(report_data.pop("user_email"))
+            if user_id is None:
+                self.stats["errors"] += 1
+                self.log(f'[ERROR] Report {report_data["iexp_report_number"]}: user not found')
+                continue
+            report_data["user_id"] = user_id
+            valid.append((report_data, item_data))
+
+        snapshots = fx.snapshots_for(item_data["expense_date"] for _, item_data in valid if item_data is not None)
+        rates = policy_rates.compiled()
+        # Numbered outside the batch transaction so the counter row isn't locked for the whole batch.
+        reports, new_reports = self.prepare_reports([report_data for report_data, _ in valid])
+        with transaction.atomic():
+            self.create_reports(reports, new_reports)
+            items = []
+            deltas = {}
+            for report_data, item_data in valid:
+                report_pk, report_currency = reports[report_data["iexp_report_number"]]
+                if item_data is None:
+                    continue
+                rate = snapshots[item_data["expense_date"]].get_rate(item_data["receipt_currency"], report_currency)
+                if rate is None:
+                    self.stats["errors"] += 1
+                    self.log(f'[ERROR] Report {report_data["iexp_report_number"]}: no exchange rate for {item_data["receipt_currency"]}')
+                    continue
+                item = ExpenseItem(report_id=report_pk, **item_data)
+                item.hotel_daily_base_rate, item.mileage_rate = rates.resolve_item(
+                    item.expense_type, self.city_names.get(item.city_id), self.company_codes.get(report_data["user_id"]), on=item.expense_date,
+                )
+                item.apply_conversion(rate)
+                items.append(item)
+                deltas[report_pk] = deltas.get(report_pk, Decimal(0)) + item.converted_amount
+
+            ExpenseItem.objects.bulk_create(items, batch_size=self.batch_size)
+            self.apply_report_deltas(deltas)
+            self.write_checkpoint(rows_done + len(batch))
+
+        self.stats["rows"] += len(batch)
+        self.stats["items"] += len(items)
+        return len(batch)
+
+    def parse_row(self, row):
+        row = {key: (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+        legacy_number = row.get("iexp_report_number")
+        if not legacy_number:
+            raise RowError("iexp_report_number is required")
+        if not row.get("user_email"):
+            raise RowError("user_email is required")
+
+        report_status = row.get("report_status") or ExpenseReport.ReportStatus.SUBMITTED
+        if report_status not in ExpenseReport.ReportStatus.values:
+            raise RowError(f'Invalid report_status "{report_status}"')
+
+        report_data = {
+            "iexp_report_number": str(legacy_number),
+            "user_email": row["user_email"].lower(),
+            "report_status": report_status,
+            "report_currency": (row.get("report_currency") or "USD").upper(),
+            "report_date": self.parse_date_value(row, "report_date"),
+            "report_submit_date": self.parse_date_value(row, "report_submit_date"),
+        }
+        for column, field in REPORT_TEXT_COLUMNS.items():
+            report_data[field] = row.get(column) or ""
+
+        if not row.get("receipt_amount"):
+            return report_data, None
+
+        receipt_amount = parse_amount(row["receipt_amount"])
+        if receipt_amount is None or abs(receipt_amount) >= MAX_RECEIPT_AMOUNT:
+            raise RowError(f'Invalid receipt_amount "{row["receipt_amount"]}"')
+
+        item_data = {
+            "expense_type": row.get("expense_type") or "",
+            "expense_date": self.parse_date_value(row, "expense_date"),
+            "receipt_amount": str(receipt_amount),
+            "receipt_currency": (row.get("receipt_currency") or report_data["report_currency"]).upper(),
+            "payment_method": row.get("payment_method") or "Cash",
+        }
+        for column in ITEM_TEXT_COLUMNS:
+            if row.get(column) not in (None, ""):
+                item_data[column] = row[column]
+        item_data.setdefault("justification", "")
+        for column in ITEM_INTEGER_COLUMNS:
+            if row.get(column) not in (None, ""):
+                try:
+                    item_data[column] = int(row[column])
+                except (TypeError, ValueError):
+                    raise RowError(f'Invalid {column} "{row[column]}"')
+        for column, model in LOOKUP_COLUMNS.items():
+            value = row.get(column)
+            if value:
+                pk = self.lookups[column].get(str(value).casefold())
+                if pk is None:
+                    raise RowError(f'Invalid input: {model.__name__} with value "{value}" does not exist.')
+                item_data[f"{column}_id"] = pk
+
+        return report_data, item_data
+
+    def parse_date_value(self, row, column):
+        value = row.get(column)
+        if not value:
+            return None
+        parsed = parse_date(str(value)[:10])
+        if parsed is None:
+            raise RowError(f'Invalid {column} "{value}"')
+        return parsed
+
+    def resolve_users(self, parsed):
+        missing = {report_data["user_email"] for report_data, _ in parsed} - set(self.users)
+        if missing:
+            for user_id, email, company_code in User.objects.filter(email__in=missing).values_list("pk", "email", "company_code"):
+                self.users[email.lower()] = user_id
+                self.company_codes[user_id] = company_code
+
+    def prepare_reports(self, reports_data):
+        """Map iexp_report_number -> (pk, report_currency) for existing reports, and build the
+        missing ones (keyed the same way) numbered from one allocated block."""
+        keys = {report_data["iexp_report_number"] for report_data in reports_data}
+        reports = {
+            number: (pk, currency)
+            for number, pk, currency in ExpenseReport.objects.filter(iexp_report_number__in=keys).values_list("iexp_report_number", "pk", "report_currency")
+        }
+
+        new_reports = {}
+        for report_data in reports_data:
+            number = report_data["iexp_report_number"]
+            if number not in reports and number not in new_reports:
+                new_reports[number] = ExpenseReport(report_amount=Decimal(0), **report_data)
+        if new_reports:
+            first, _ = allocate_report_numbers(len(new_reports))
+            for offset, report in enumerate(new_reports.values()):
+                report.report_number = format_report_number(first + offset)
+        return reports, new_reports
+
+    def create_reports(self, reports, new_reports):
+        """Insert the reports built by prepare_reports() and add their pks to `reports`."""
+        if not new_reports:
+            return
+        bulk_create_with_pks(ExpenseReport, new_reports.values(), "report_id", batch_size=self.batch_size)
+        for number, report in new_reports.items():
+            reports[number] = (report.pk, report.report_currency)
+        self.stats["reports"] += len(new_reports)
+
+    def apply_report_deltas(self, deltas):
+        """Add every touched report's delta in one UPDATE ... CASE statement."""
+        deltas = {pk: delta.quantize(Decimal("0.01")) for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        output_field = DecimalField(max_digits=10, decimal_places=2)
+        ExpenseReport.objects.filter(pk__in=deltas).update(
+            report_amount=F("report_amount") + Case(
+                *[When(pk=pk, then=Value(delta, output_field=output_field)) for pk, delta in deltas.items()],
+                default=Value(Decimal(0), output_field=output_field),
+                output_field=output_field,
+            ),
+            updated_at=timezone.now(),
+        )
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+        else:
+            logger.info(message)
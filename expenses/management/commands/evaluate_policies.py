@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from expenses.models import ExpenseReport
+from expenses.policy import reevaluate_reports
+
+
+class Command(BaseCommand):
+    help = "Re-run the expense policy rules over existing reports, e.g. after a rate or rule change."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", default="Submitted", help="Only check reports with this report_status ('all' for every report)")
+        parser.add_argument("--report-ids", nargs="+", default=None, help="Only check these report ids")
+        parser.add_argument("--chunk-size", type=int, default=200, help="Reports evaluated per worker task")
+        parser.add_argument("--workers", type=int, default=4, help="Worker threads, each with its own database connection")
+
+    def handle(self, *args, **options):
+        reports = ExpenseReport.objects.all()
+        if options["status"] != "all":
+            reports = reports.filter(report_status=options["status"])
+        if options["report_ids"]:
+            reports = reports.filter(report_id__in=options["report_ids"])
+
+        checked, items, violations = reevaluate_reports(
+            reports,
+            chunk_size=max(options["chunk_size"], 1),
+            workers=max(options["workers"], 1),
+            log=print,
+        )
+        print(f"[SUCCESS] Checked {items} items on {checked} reports; {violations} violations found.")
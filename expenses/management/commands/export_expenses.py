@@ -0,0 +1,52 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from expenses.exports import EXPORT_DATASETS, EXPORT_FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream expense reports or items for an org and/or date range as CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", choices=EXPORT_DATASETS, default="items")
+        parser.add_argument("--format", dest="file_format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--org-id", type=int, default=None, help="Only export reports of users in this org")
+        parser.add_argument("--start", default=None, help="First report creation date (YYYY-MM-DD)")
+        parser.add_argument("--end", default=None, help="Last report creation date (YYYY-MM-DD)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows fetched per database round trip")
+        parser.add_argument("--output", default="-", help="Output file path, '-' for stdout")
+
+    def handle(self, *args, **options):
+        start_date = self.parse_date_option(options["start"], "--start")
+        end_date = self.parse_date_option(options["end"], "--end")
+
+        chunks = stream_export(
+            options["dataset"],
+            options["file_format"],
+            org_id=options["org_id"],
+            start_date=start_date,
+            end_date=end_date,
+            chunk_size=options["chunk_size"],
+        )
+
+        output = sys.stdout if options["output"] == "-" else open(options["output"], "w", newline="")
+        rows = 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                rows += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if options["output"] != "-":
+            self.stderr.write(f"[SUCCESS] Wrote {rows} lines to {options['output']}")
+
+    def parse_date_option(self, value, name):
+        if value is None:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{name} must be a date in YYYY-MM-DD format.")
+        return parsed
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from expenses.receipt_cleanup import S3_DELETE_BATCH_SIZE, flush_pending_deletes
+
+
+class Command(BaseCommand):
+    help = "Delete S3 objects queued in pending_s3_delete, in DeleteObjects batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=S3_DELETE_BATCH_SIZE, help="Keys per DeleteObjects call (max 1000)")
+        parser.add_argument("--max-attempts", type=int, default=10, help="Skip entries that already failed this many times")
+
+    def handle(self, *args, **options):
+        batch_size = min(max(options["batch_size"], 1), S3_DELETE_BATCH_SIZE)
+        deleted, failed = flush_pending_deletes(batch_size=batch_size, max_attempts=options["max_attempts"])
+        if failed:
+            print(f"[ERROR] {failed} objects could not be deleted and stay queued.")
+        print(f"[SUCCESS] Deleted {deleted} S3 objects.")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from expenses.derivatives import generate_derivatives, pending_receipts
+
+
+class Command(BaseCommand):
+    help = "Create thumbnails and previews for receipts that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Receipts downloaded and rendered per batch")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many receipts")
+
+    def handle(self, *args, **options):
+        batch_size = max(options["batch_size"], 1)
+        processed = updated = 0
+        last_pk = 0
+        while options["limit"] is None or processed < options["limit"]:
+            size = batch_size if options["limit"] is None else min(batch_size, options["limit"] - processed)
+            batch = list(pending_receipts().filter(pk__gt=last_pk)[:size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            processed += len(batch)
+            updated += generate_derivatives(batch)
+            print(f"[INFO] Processed {processed} receipts")
+        print(f"[SUCCESS] Updated {updated} of {processed} receipts.")
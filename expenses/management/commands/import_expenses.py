@@ -0,0 +1,32 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.imports import IMPORT_FORMATS, ExpenseImporter
+from expenses.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Bulk import legacy iExpense reports and items from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", type=str, help="Path to the CSV or JSONL file")
+        parser.add_argument("--format", dest="file_format", choices=IMPORT_FORMATS, default=None, help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows validated and inserted per transaction")
+        parser.add_argument("--checkpoint", default=None, help="Checkpoint name; defaults to the file's absolute path")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the first row")
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        if not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+
+        file_format = options["file_format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        checkpoint = options["checkpoint"] or os.path.abspath(path)
+        if options["restart"]:
+            ImportCheckpoint.objects.filter(name=checkpoint).delete()
+
+        importer = ExpenseImporter(batch_size=options["batch_size"], checkpoint_name=checkpoint, stdout=self.stdout)
+        stats = importer.run(path, file_format)
+        self.stdout.write(
+            f"[SUCCESS] Processed {stats['rows']} rows: {stats['reports']} reports and {stats['items']} items created, {stats['errors']} errors"
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from expenses.models import ExpenseReport
+
+
+class Command(BaseCommand):
+    help = "Find reports whose running report_amount has drifted from the SUM of their items and fix them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--report-ids", nargs="+", default=None, help="Only check these report ids")
+        parser.add_argument("--dry-run", action="store_true", help="List drifted reports without fixing them")
+
+    def handle(self, *args, **options):
+        reports = ExpenseReport.objects.all()
+        if options["report_ids"]:
+            reports = reports.filter(report_id__in=options["report_ids"])
+
+        # One aggregate query finds the candidates; each is then re-checked under a row lock.
+        drifted = list(
+            reports.annotate(
+                item_total=Coalesce(Sum("expenseitem__converted_amount"), Value(0), output_field=DecimalField(max_digits=14, decimal_places=2)),
+                unconverted=Count("expenseitem", filter=Q(expenseitem__converted_amount__isnull=True)),
+            )
+            .filter(unconverted=0)
+            .exclude(report_amount=F("item_total"))
+            .order_by("pk")
+        )
+        print(f"[INFO] {len(drifted)} reports drifted")
+
+        fixed = 0
+        for report in drifted:
+            print(f"[INFO] Report {report.report_id}: stored {report.report_amount}, items sum to {report.item_total}")
+            if not options["dry_run"]:
+                report.reconcile_report_amount()
+                fixed += 1
+        print(f"[SUCCESS] Reconciled {fixed} reports.")
@@ -0,0 +1,29 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+
+from expenses.receipt_cleanup import sweep_orphans
+
+
+class Command(BaseCommand):
+    help = "List receipt objects in the bucket and delete the ones no ExpenseReceipt references."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="", help="Only sweep keys under this prefix, e.g. '<report_id>/'")
+        parser.add_argument("--min-age-hours", type=float, default=24, help="Ignore objects modified more recently than this")
+        parser.add_argument("--workers", type=int, default=4, help="Parallel DeleteObjects calls")
+        parser.add_argument("--dry-run", action="store_true", help="Report orphans without deleting them")
+
+    def handle(self, *args, **options):
+        found, failed = sweep_orphans(
+            prefix=options["prefix"],
+            min_age=timedelta(hours=options["min_age_hours"]),
+            workers=max(options["workers"], 1),
+            dry_run=options["dry_run"],
+            log=print,
+        )
+        if options["dry_run"]:
+            print(f"[INFO] Found {found} orphaned objects (dry run, nothing deleted).")
+            return
+        if failed:
+            print(f"[ERROR] {failed} orphaned objects could not be deleted.")
+        print(f"[SUCCESS] Deleted {found - failed} orphaned objects.")
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+def seed_report_number_counter(apps, schema_editor):
+    ExpenseReport = apps.get_model('expenses', 'ExpenseReport')
+    ReportNumberCounter = apps.get_model('expenses', 'ReportNumberCounter')
+
+    last_value = 999
+    for report_number in ExpenseReport.objects.values_list('report_number', flat=True).iterator():
+        if report_number and report_number.isdigit():
+            last_value = max(last_value, int(report_number))
+
+    ReportNumberCounter.objects.update_or_create(scope='expense_report', defaults={'last_value': last_value})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_alter_expensereceipt_s3_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'report_number_counter',
+                'managed': True,
+            },
+        ),
+        migrations.RunPython(seed_report_number_counter, migrations.RunPython.noop),
+    ]
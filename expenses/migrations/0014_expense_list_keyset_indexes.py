@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0005_remove_mileagerate_title_alter_mileagerate_value'),
+        ('expenses', '0013_reportnumbercounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expenseitem',
+            index=models.Index(fields=['report', 'created_at', 'id'], name='expense_item_report_created'),
+        ),
+        migrations.AddIndex(
+            model_name='expensereport',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='expense_report_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='expensereport',
+            index=models.Index(fields=['created_at', 'id'], name='expense_report_created'),
+        ),
+    ]
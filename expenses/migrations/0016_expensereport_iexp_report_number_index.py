@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0015_expensereport_claims'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expensereport',
+            name='iexp_report_number',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+    ]
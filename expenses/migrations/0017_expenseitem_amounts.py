@@ -0,0 +1,78 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:38
+
+from decimal import Decimal
+
+from django.db import migrations, models, transaction
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_item_amounts(apps, schema_editor):
+    ExchangeRate = apps.get_model('common', 'ExchangeRate')
+    ExpenseItem = apps.get_model('expenses', 'ExpenseItem')
+
+    rates = {}
+    latest_rate = ExchangeRate.objects.order_by('-date_fetched').first()
+    if latest_rate:
+        rates = dict(ExchangeRate.objects.filter(date_fetched=latest_rate.date_fetched).values_list('target_currency', 'rate'))
+
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                ExpenseItem.objects.filter(pk__gt=last_pk)
+                .select_related('report')
+                .only('pk', 'receipt_amount', 'receipt_currency', 'report__report_currency')
+                .order_by('pk')[:BACKFILL_BATCH_SIZE]
+            )
+            if not batch:
+                break
+
+            for item in batch:
+                try:
+                    item.amount = Decimal(str(item.receipt_amount).strip()).quantize(Decimal('0.01'))
+                except (ArithmeticError, ValueError, TypeError):
+                    item.amount = None
+
+                from_currency = (item.receipt_currency or '').upper()
+                to_currency = (item.report.report_currency or '').upper() if item.report else None
+                if not to_currency or from_currency == to_currency:
+                    item.conversion_rate = Decimal(1)
+                elif from_currency in rates and to_currency in rates:
+                    item.conversion_rate = rates[to_currency] / rates[from_currency]
+                else:
+                    item.conversion_rate = None
+
+                if item.amount is not None and item.conversion_rate is not None:
+                    item.converted_amount = (item.amount * item.conversion_rate).quantize(Decimal('0.01'))
+
+            ExpenseItem.objects.bulk_update(batch, ['amount', 'conversion_rate', 'converted_amount'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('common', '0005_remove_mileagerate_title_alter_mileagerate_value'),
+        ('expenses', '0016_expensereport_iexp_report_number_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseitem',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='expenseitem',
+            name='conversion_rate',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='expenseitem',
+            name='converted_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.RunPython(backfill_item_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0017_expenseitem_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingS3Delete',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('s3_path', models.CharField(max_length=2000)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'pending_s3_delete',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0018_pendings3delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0019_expensereceipt_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='preview_path',
+            field=models.CharField(blank=True, max_length=2000, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensereceipt',
+            name='thumbnail_path',
+            field=models.CharField(blank=True, max_length=2000, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0020_expensereceipt_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseitem',
+            name='policy_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expenseitem',
+            name='policy_violations',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,11 +1,43 @@
 # expenses/models.py
 
 from decimal import Decimal
+import logging
+import os
+import re
+import time
 import uuid
-from django.db import models
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from django.utils.text import get_valid_filename
 from Template.models import UppercaseCharField
+from expenses.report_numbers import next_report_number
 from users.models import User
-from common.models import Airline, ExchangeRate, RentalAgency, CarType, MealCategory, RelationshipToPAI, City, HotelDailyBaseRate, MileageRate
+from common.fx import CENT, fx
+from common.models import Airline, RentalAgency, CarType, MealCategory, RelationshipToPAI, City, HotelDailyBaseRate, MileageRate
+
+logger = logging.getLogger(__name__)
+
+def parse_amount(value):
+    """Parse a receipt amount string into a 2-place Decimal, or None if it isn't numeric."""
+    try:
+        amount = Decimal(str(value).strip())
+        return amount.quantize(CENT) if amount.is_finite() else None
+    except (ArithmeticError, ValueError, TypeError):
+        return None
+
+class ReportNumberCounter(models.Model):
+    scope = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'report_number_counter'
+
+    def __str__(self):
+        return f'{self.scope}: {self.last_value}'
 
 class ExpenseReport(models.Model):
     class ReportStatus(models.TextChoices):
@@ -36,23 +68,33 @@ class ExpenseReport(models.Model):
     integration_date = models.DateField(null=True)
     error = models.BooleanField(default=True)
     iexp_report_status = models.CharField(max_length=100, null=True, blank=True)
-    iexp_report_number = models.CharField(max_length=100, null=True, blank=True)
+    iexp_report_number = models.CharField(max_length=100, null=True, blank=True, db_index=True)
     paid_amount = models.CharField(max_length=100, null=True, blank=True)
+    claimed_by = models.ForeignKey(User, null=True, blank=True, related_name='claimed_expense_reports', on_delete=models.SET_NULL)
+    claimed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    STATUS_TRANSITIONS = {
+        ReportStatus.OPEN: (ReportStatus.SUBMITTED,),
+        ReportStatus.SUBMITTED: (ReportStatus.APPROVED, ReportStatus.REJECTED, ReportStatus.OPEN),
+        ReportStatus.APPROVED: (ReportStatus.PAID, ReportStatus.REJECTED),
+        ReportStatus.REJECTED: (ReportStatus.OPEN, ReportStatus.SUBMITTED),
+        ReportStatus.PAID: (),
+    }
+
     class Meta:
         managed = True
         db_table = 'expense_report'
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='expense_report_user_created'),
+            models.Index(fields=['created_at', 'id'], name='expense_report_created'),
+            models.Index(fields=['report_status', 'report_submit_date', 'id'], name='expense_report_status_queue'),
+        ]
         
     def save(self, *args, **kwargs):
         if not self.report_number:
-            last_report = ExpenseReport.objects.all().order_by('created_at').last()
-            if last_report:
-                last_report_number = int(last_report.report_number)
-                self.report_number = f'{last_report_number + 1:04d}'
-            else:
-                self.report_number = '1000'
+            self.report_number = next_report_number()
         if self.report_currency:
             self.report_currency = self.report_currency.upper()
         
@@ -66,6 +108,64 @@ class ExpenseReport(models.Model):
 
         super().save(*args, **kwargs)
 
+    @classmethod
+    def source_statuses(cls, target_status):
+        """Statuses a report may move to `target_status` from."""
+        return [source for source, targets in cls.STATUS_TRANSITIONS.items() if target_status in targets]
+
+    @classmethod
+    def status_changes(cls, target_status):
+        """Column values for moving a report to `target_status`; any move releases a reviewer's claim."""
+        now = timezone.now()
+        changes = {'report_status': target_status, 'updated_at': now, 'claimed_by': None, 'claimed_at': None}
+        if target_status == cls.ReportStatus.SUBMITTED:
+            changes.update(integration_status=cls.IntegrationStatus.PENDING, report_submit_date=now.date())
+        return changes
+
+    def apply_amount_delta(self, delta):
+        """Add `delta` to report_amount with a single UPDATE so concurrent item writes can't lose updates."""
+        delta = Decimal(delta).quantize(CENT)
+        if delta:
+            ExpenseReport.objects.filter(pk=self.pk).update(
+                report_amount=F('report_amount') + delta,
+                updated_at=timezone.now(),
+            )
+
+    def compute_report_amount(self):
+        """Recompute the total as SUM(converted_amount) over the report's items.
+
+        Returns None when an item has no converted_amount yet, since the SUM can't be trusted then.
+        """
+        totals = ExpenseItem.objects.filter(report_id=self.pk).aggregate(
+            total=Sum('converted_amount'), unconverted=Count('pk', filter=Q(converted_amount__isnull=True)),
+        )
+        if totals['unconverted']:
+            return None
+        return (totals['total'] or Decimal(0)).quantize(CENT)
+
+    def reconcile_report_amount(self):
+        """Overwrite report_amount with the SUM over items if the running total has drifted.
+
+        Run by the reconcile_report_amounts command rather than on every write.
+        """
+        with transaction.atomic():
+            # Lock the report first so the SUM below sees every item committed before us.
+            stored_amount = ExpenseReport.objects.select_for_update().values_list('report_amount', flat=True).get(pk=self.pk)
+            computed_amount = self.compute_report_amount()
+            if computed_amount is None:
+                logger.warning(f'Report {self.report_id} has items without a converted amount; not reconciled')
+            elif stored_amount != computed_amount:
+                logger.warning(f'Report {self.report_id} amount drifted: stored {stored_amount}, computed {computed_amount}')
+                ExpenseReport.objects.filter(pk=self.pk).update(report_amount=computed_amount, updated_at=timezone.now())
+        return computed_amount
+
+class ExpenseItemQuerySet(models.QuerySet):
+    LOOKUP_FIELDS = ('airline', 'rental_agency', 'car_type', 'meal_category', 'relationship_to_pai', 'city')
+
+    def with_lookups(self):
+        """Join the lookup tables and prefetch receipts so serializing N items costs a fixed number of queries."""
+        return self.select_related(*self.LOOKUP_FIELDS).prefetch_related('receipts')
+
 class ExpenseItem(models.Model):
     id = models.AutoField(primary_key=True)
     item_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -76,6 +176,9 @@ class ExpenseItem(models.Model):
     payment_method = models.CharField(max_length=100, default="Cash")
     receipt_amount = models.CharField(max_length=200)
     receipt_currency = UppercaseCharField(max_length=5)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    conversion_rate = models.DecimalField(max_digits=20, decimal_places=6, null=True, blank=True)
+    converted_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
     justification = models.CharField(max_length=2000)
     note = models.CharField(max_length=2000, null=True)
 
@@ -108,17 +211,25 @@ class ExpenseItem(models.Model):
     carrier = models.CharField(max_length=200, null=True)
     distance = models.CharField(max_length=200, null=True)
     mileage_rate = models.ForeignKey(MileageRate, null=True, on_delete=models.SET_NULL)
+    policy_violations = models.JSONField(default=list, blank=True)
+    policy_checked_at = models.DateTimeField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ExpenseItemQuerySet.as_manager()
+
     class Meta:
         managed = True
         db_table = 'expense_item'
+        indexes = [
+            models.Index(fields=['report', 'created_at', 'id'], name='expense_item_report_created'),
+        ]
         
     def save(self, *args, **kwargs):
         if self.receipt_currency:
             self.receipt_currency = self.receipt_currency.upper()
+        self.amount = parse_amount(self.receipt_amount)
         
         request = kwargs.pop("request", None)
 
@@ -128,7 +239,7 @@ class ExpenseItem(models.Model):
             user_default_currency = user_default_currency.upper()
 
         if self.receipt_currency and user_default_currency and self.receipt_currency != user_default_currency:
-            self.exchange_rate = self.get_exchange_rate(self.receipt_currency, user_default_currency)
+            self.exchange_rate = self.get_exchange_rate(self.receipt_currency, user_default_currency, on=self.expense_date)
 
         if not self.pk and request and hasattr(request, "user"):
             self.created_by = request.user
@@ -138,16 +249,22 @@ class ExpenseItem(models.Model):
 
         super().save(*args, **kwargs)
 
-    def get_exchange_rate(self, from_currency, to_currency):
-        if from_currency == to_currency:
-            return Decimal(1)
-        try:
-            latest_rate = ExchangeRate.objects.latest('date_fetched')
-            from_rate = ExchangeRate.objects.get(target_currency=from_currency, date_fetched=latest_rate.date_fetched).rate
-            to_rate = ExchangeRate.objects.get(target_currency=to_currency, date_fetched=latest_rate.date_fetched).rate
-            return to_rate / from_rate
-        except ExchangeRate.DoesNotExist:
-            return None
+    def get_exchange_rate(self, from_currency, to_currency, on=None):
+        return fx.get_rate(from_currency, to_currency, on=on)
+
+    def apply_conversion(self, rate):
+        """Store the numeric amount and its value in the report currency at `rate`.
+
+        exchange_rate records the same rate, as the serializer's single-item path does.
+        """
+        self.amount = parse_amount(self.receipt_amount)
+        self.conversion_rate = rate
+        self.exchange_rate = rate
+        if self.amount is not None and rate is not None:
+            self.converted_amount = (self.amount * rate).quantize(CENT)
+        else:
+            self.converted_amount = None
+        return self.converted_amount
         
 
 class ExpenseReceipt(models.Model):
@@ -155,11 +272,57 @@ class ExpenseReceipt(models.Model):
     expense_item = models.ForeignKey(ExpenseItem, related_name="receipts", on_delete=models.CASCADE)
     s3_path = models.CharField(max_length=2000, null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=255, null=True, blank=True)
+    checksum = models.CharField(max_length=255, null=True, blank=True)
+    verified_at = models.DateTimeField(null=True, blank=True)
+    thumbnail_path = models.CharField(max_length=2000, null=True, blank=True)
+    preview_path = models.CharField(max_length=2000, null=True, blank=True)
 
     class Meta:
         db_table = 'expense_receipt'
 
+    @staticmethod
+    def clean_filename(filename):
+        """Reduce a client-supplied filename to a safe basename, so it can't leave the item's prefix."""
+        name = os.path.basename(str(filename).replace("\\", "/"))
+        name = re.sub(r"\.{2,}", ".", name)
+        try:
+            return get_valid_filename(name)
+        except SuspiciousFileOperation:
+            return "receipt"
+
+    @staticmethod
+    def build_s3_path(report_id, item_id, filename, timestamp=None):
+        epoch_timestamp = int(timestamp if timestamp is not None else time.time())
+        return f'{report_id}/{item_id}/{epoch_timestamp}_{ExpenseReceipt.clean_filename(filename)}'
+
     def __str__(self):
         return f"Receipt {self.id} for ExpenseItem {self.expense_item.id} - {self.receipt_amount} {self.receipt_currency}"
 
 
+class PendingS3Delete(models.Model):
+    s3_path = models.CharField(max_length=2000)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'pending_s3_delete'
+
+    def __str__(self):
+        return f"Pending delete {self.s3_path} ({self.attempts} attempts)"
+
+
+class ImportCheckpoint(models.Model):
+    name = models.CharField(max_length=500, unique=True)
+    rows_done = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'import_checkpoint'
+
+    def __str__(self):
+        return f"Import {self.name} at row {self.rows_done}"
+
+
@@ -0,0 +1,19 @@
+# pagination.py
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Keyset pagination on (created_at, id). Cursors are opaque and no COUNT(*) is issued."""
+    page_size = getattr(settings, "EXPENSES_PAGE_SIZE", 50)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "EXPENSES_MAX_PAGE_SIZE", 500)
+    ordering = ("-created_at", "-id")
+
+
+class ExpenseReportCursorPagination(CreatedAtCursorPagination):
+    ordering = ("-created_at", "-id")
+
+
+class ExpenseItemCursorPagination(CreatedAtCursorPagination):
+    ordering = ("created_at", "id")
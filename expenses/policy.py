@@ -0,0 +1,186 @@
+# policy.py
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from common.fx import CENT, fx
+from common.policy_rates import policy_rates
+from .models import ExpenseItem, ExpenseReport
+
+logger = logging.getLogger(__name__)
+
+ATTENDEE_FIELDS = tuple(f"attendee{number}" for number in range(1, 11))
+
+# Every field a policy run writes, for bulk_update.
+POLICY_FIELDS = ["hotel_daily_base_rate", "mileage_rate", "policy_violations", "policy_checked_at"]
+
+_rules = []
+
+
+def rule(*expense_types):
+    """Register a check for items of the given expense types (all items when none are given).
+
+    A rule is called as rule(item, context) and returns a list of violations.
+    """
+    def register(func):
+        _rules.append((expense_types, func))
+        return func
+    return register
+
+
+def violation(code, message, limit=None, actual=None):
+    result = {"rule": code, "message": message}
+    if limit is not None:
+        result["limit"] = str(limit)
+    if actual is not None:
+        result["actual"] = str(actual)
+    return result
+
+
+def parse_decimal(value):
+    try:
+        return Decimal(str(value).replace(",", "").strip())
+    except (InvalidOperation, ValueError):
+        return None
+
+
+@rule("Hotel")
+def check_hotel_rate(item, context):
+    rate = item.hotel_daily_base_rate
+    if rate is None:
+        return [violation("hotel_rate_missing", "No hotel daily base rate applies to this city.")]
+    if item.amount is None:
+        return []
+    conversion_rate = context.snapshots[item.expense_date].get_rate(item.receipt_currency, rate.currency)
+    if conversion_rate is None:
+        return [violation("hotel_rate_currency", f"No exchange rate from {item.receipt_currency} to {rate.currency} to compare with the hotel rate.")]
+    nightly = (item.amount * conversion_rate).quantize(CENT)
+    if nightly > rate.amount:
+        return [violation("hotel_over_limit", f"Hotel amount {nightly} {rate.currency} is over the daily base rate of {rate.amount} {rate.currency}.", rate.amount, nightly)]
+    return []
+
+
+@rule("Hotel")
+def check_hotel_nights(item, context):
+    if item.expense_date is not None and context.hotel_nights[item.expense_date] > 1:
+        return [violation("hotel_duplicate_night", f"{context.hotel_nights[item.expense_date]} hotel items are dated {item.expense_date}.")]
+    return []
+
+
+@rule("Mileage")
+def check_mileage(item, context):
+    if item.mileage_rate is None:
+        return [violation("mileage_rate_missing", "No mileage rate applies to this company.")]
+    distance = parse_decimal(item.distance) if item.distance else None
+    if distance is None or distance <= 0:
+        return [violation("mileage_distance_missing", "Distance is required to check the mileage amount.")]
+    limit = (distance * item.mileage_rate.rate).quantize(CENT)
+    if item.amount is not None and item.amount > limit:
+        return [violation("mileage_over_limit", f"Mileage amount {item.amount} is over {distance} x {item.mileage_rate.rate} = {limit}.", limit, item.amount)]
+    return []
+
+
+@rule()
+def check_meal_attendees(item, context):
+    if item.meal_category_id is None:
+        return []
+    if not item.total_attendees or item.total_attendees < 1:
+        return [violation("meal_attendees_missing", "Meals need the total number of attendees.")]
+    named = sum(1 for field in ATTENDEE_FIELDS if (getattr(item, field) or "").strip() not in ("", "N/A"))
+    if named > item.total_attendees:
+        return [violation("meal_attendee_count", f"{named} attendees are named but total_attendees is {item.total_attendees}.", item.total_attendees, named)]
+    if named < min(item.total_attendees, len(ATTENDEE_FIELDS)):
+        return [violation("meal_attendee_count", f"total_attendees is {item.total_attendees} but only {named} attendees are named.", item.total_attendees, named)]
+    return []
+
+
+class PolicyContext:
+    """What the rules may look at besides the item: report-wide tallies and FX snapshots."""
+
+    def __init__(self, report, items, snapshots):
+        self.report = report
+        self.snapshots = snapshots
+        self.hotel_nights = Counter(item.expense_date for item in items if item.expense_type == "Hotel" and item.expense_date)
+
+
+class PolicyRuleSet:
+    """The registered rules indexed by expense type, so each item only runs the rules that apply."""
+
+    def __init__(self, rules):
+        self.common = [func for expense_types, func in rules if not expense_types]
+        self.by_type = {}
+        for expense_types, func in rules:
+            for expense_type in expense_types:
+                self.by_type.setdefault(expense_type, []).append(func)
+
+    def evaluate(self, item, context):
+        violations = []
+        for func in self.by_type.get(item.expense_type, []) + self.common:
+            violations.extend(func(item, context))
+        return violations
+
+
+def get_rule_set():
+    return PolicyRuleSet(_rules)
+
+
+def evaluate_reports(reports):
+    """Check every item of `reports` in one pass and store the results. Returns (items, violations).
+
+    Items are loaded with one query, hotel and mileage limits are re-pinned from the compiled
+    policy rates, and all items are written back with one bulk_update.
+    """
+    reports = {report.pk: report for report in reports}
+    if not reports:
+        return 0, 0
+    items = list(ExpenseItem.objects.filter(report_id__in=reports).select_related("city").order_by("report_id", "id"))
+    snapshots = fx.snapshots_for(item.expense_date for item in items)
+    rule_set = get_rule_set()
+    now = timezone.now()
+
+    by_report = {}
+    for item in items:
+        by_report.setdefault(item.report_id, []).append(item)
+
+    violations = 0
+    for report_pk, report_items in by_report.items():
+        report = reports[report_pk]
+        policy_rates.apply_to_items(report_items, getattr(report.user, "company_code", None))
+        context = PolicyContext(report, report_items, snapshots)
+        for item in report_items:
+            item.policy_violations = rule_set.evaluate(item, context)
+            item.policy_checked_at = now
+            violations += len(item.policy_violations)
+
+    with transaction.atomic():
+        ExpenseItem.objects.bulk_update(items, POLICY_FIELDS, batch_size=500)
+    return len(items), violations
+
+
+def _evaluate_chunk(report_pks):
+    try:
+        return evaluate_reports(ExpenseReport.objects.filter(pk__in=report_pks).select_related("user"))
+    finally:
+        connection.close()
+
+
+def reevaluate_reports(queryset, chunk_size=200, workers=4, log=None):
+    """Re-run the rules over many reports in parallel chunks, e.g. after a policy change.
+
+    Report pks are read in pk order and each chunk is evaluated on a worker thread with its own
+    database connection. Returns (reports, items, violations).
+    """
+    report_pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+    chunks = [report_pks[start:start + chunk_size] for start in range(0, len(report_pks), chunk_size)]
+    items = violations = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done, (chunk_items, chunk_violations) in enumerate(executor.map(_evaluate_chunk, chunks), start=1):
+            items += chunk_items
+            violations += chunk_violations
+            if log:
+                log(f"[INFO] Checked {min(done * chunk_size, len(report_pks))} of {len(report_pks)} reports")
+    return len(report_pks), items, violations
@@ -0,0 +1,100 @@
+# receipt_cleanup.py
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ExpenseReceipt, PendingS3Delete
+from .storage import S3_DELETE_BATCH_SIZE, get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def queue_s3_deletes(s3_paths):
+    s3_paths = [s3_path for s3_path in s3_paths if s3_path]
+    if s3_paths:
+        PendingS3Delete.objects.bulk_create([PendingS3Delete(s3_path=s3_path) for s3_path in s3_paths])
+
+
+def parse_receipt_key(key):
+    """Return the report_id of a `<report_id>/<item_id>/<file>` key, or None for keys we don't own."""
+    parts = key.split("/", 2)
+    if len(parts) != 3:
+        return None
+    try:
+        report_id = uuid.UUID(parts[0])
+        uuid.UUID(parts[1])
+    except ValueError:
+        return None
+    return report_id
+
+
+def referenced_keys(keys):
+    """The subset of `keys` still used by an ExpenseReceipt, looked up through the indexed report_id."""
+    report_ids = {report_id for report_id in map(parse_receipt_key, keys) if report_id}
+    if not report_ids:
+        return set()
+    paths = set()
+    for row in ExpenseReceipt.objects.filter(expense_item__report__report_id__in=report_ids).values_list("s3_path", "thumbnail_path", "preview_path"):
+        paths.update(row)
+    return set(keys) & paths
+
+
+def flush_pending_deletes(batch_size=S3_DELETE_BATCH_SIZE, s3_paths=None, max_attempts=10):
+    """Delete queued objects from receipt storage in batches. Returns (deleted, failed)."""
+    queryset = PendingS3Delete.objects.filter(attempts__lt=max_attempts).order_by("pk")
+    if s3_paths is not None:
+        queryset = queryset.filter(s3_path__in=list(s3_paths))
+
+    deleted = failed = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).values_list("pk", "s3_path")[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+
+        keys = {s3_path for _, s3_path in batch}
+        keep = referenced_keys(keys)
+        errors = get_storage().delete_many(keys - keep)
+
+        done_pks = [pk for pk, s3_path in batch if s3_path not in errors]
+        PendingS3Delete.objects.filter(pk__in=done_pks).delete()
+        for pk, s3_path in batch:
+            if s3_path in errors:
+                PendingS3Delete.objects.filter(pk=pk).update(attempts=F("attempts") + 1, last_error=errors[s3_path])
+        deleted += len(keys - keep) - len(errors)
+        failed += len(errors)
+
+    return deleted, failed
+
+
+def find_orphans(prefix="", min_age=timedelta(hours=24)):
+    """Yield lists of receipt keys in storage that no ExpenseReceipt references, one list per listing page.
+
+    Objects newer than `min_age` are skipped so uploads in flight are never collected.
+    """
+    cutoff = timezone.now() - min_age
+    for objects in get_storage().list(prefix):
+        keys = {obj["key"] for obj in objects if obj["last_modified"] <= cutoff and parse_receipt_key(obj["key"])}
+        orphans = sorted(keys - referenced_keys(keys))
+        if orphans:
+            yield orphans
+
+
+def sweep_orphans(prefix="", min_age=timedelta(hours=24), workers=4, dry_run=False, log=None):
+    """Purge unreferenced receipt objects, deleting batches on a thread pool. Returns (found, failed)."""
+    found = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for orphans in find_orphans(prefix, min_age):
+            found += len(orphans)
+            if log:
+                log(f"[INFO] {len(orphans)} orphaned objects, e.g. {orphans[0]}")
+            if not dry_run:
+                futures.append(executor.submit(get_storage().delete_many, orphans))
+        for future in futures:
+            failed += len(future.result())
+    return found, failed
@@ -0,0 +1,84 @@
+# report_numbers.py
+import logging
+import threading
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+REPORT_NUMBER_SCOPE = "expense_report"
+REPORT_NUMBER_START = 1000
+
+
+def allocate_report_numbers(count=1, scope=REPORT_NUMBER_SCOPE):
+    """Reserve `count` consecutive report numbers and return them as (first, last).
+
+    The counter row is bumped with a single UPDATE ... SET last_value = last_value + count,
+    so concurrent callers serialize on that one row instead of scanning expense_report.
+    """
+    from .models import ReportNumberCounter
+
+    with transaction.atomic():
+        updated = ReportNumberCounter.objects.filter(scope=scope).update(last_value=F('last_value') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ReportNumberCounter.objects.create(scope=scope, last_value=REPORT_NUMBER_START - 1 + count)
+                return REPORT_NUMBER_START, REPORT_NUMBER_START + count - 1
+            except IntegrityError:
+                # Another worker created the row first; fall back to the normal increment.
+                ReportNumberCounter.objects.filter(scope=scope).update(last_value=F('last_value') + count)
+        last_value = ReportNumberCounter.objects.filter(scope=scope).values_list('last_value', flat=True).get()
+    return last_value - count + 1, last_value
+
+
+def format_report_number(value):
+    return f'{value:04d}'
+
+
+class ReportNumberAllocator:
+    """Hands out report numbers from a block reserved per worker process.
+
+    With REPORT_NUMBER_BLOCK_SIZE > 1 each process reserves that many numbers at once and
+    serves them from memory, trading strictly dense numbering for fewer counter updates
+    under burst load. Blocks are only cached in autocommit mode: a block reserved inside
+    an outer transaction could be rolled back while still held in memory.
+    """
+
+    def __init__(self, scope=REPORT_NUMBER_SCOPE, block_size=None):
+        self.scope = scope
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = None
+        self._last = None
+
+    def get_block_size(self):
+        if self.block_size is not None:
+            return self.block_size
+        return max(int(getattr(settings, "REPORT_NUMBER_BLOCK_SIZE", 1)), 1)
+
+    def next(self):
+        if connection.in_atomic_block:
+            first, _ = allocate_report_numbers(1, self.scope)
+            return first
+
+        with self._lock:
+            if self._next is None or self._next > self._last:
+                self._next, self._last = allocate_report_numbers(self.get_block_size(), self.scope)
+                logger.debug(f'Reserved report numbers {self._next}-{self._last} for scope {self.scope}')
+            value = self._next
+            self._next += 1
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._next = None
+            self._last = None
+
+
+report_number_allocator = ReportNumberAllocator()
+
+
+def next_report_number():
+    return format_report_number(report_number_allocator.next())
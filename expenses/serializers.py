@@ -1,11 +1,15 @@
 from decimal import Decimal
 import logging
 import time
+from django.db import transaction
 from rest_framework.exceptions import ValidationError
 from rest_framework import serializers
-from common.models import Airline, CarType, City, ExchangeRate, HotelDailyBaseRate, MealCategory, MileageRate, RelationshipToPAI, RentalAgency
-from expenses.utils import generate_presigned_url
-from .models import ExpenseReceipt, ExpenseReport, ExpenseItem
+from common.fx import fx
+from common.policy_rates import policy_rates
+from common.reference_data import reference_index
+from common.models import Airline, CarType, City, HotelDailyBaseRate, MealCategory, MileageRate, RelationshipToPAI, RentalAgency
+from expenses.storage import get_storage
+from .models import CENT, ExpenseReceipt, ExpenseReport, ExpenseItem
 from rest_framework.response import Response
 from rest_framework import status
 
@@ -25,10 +29,13 @@ class ExpenseReceiptSerializer(serializers.ModelSerializer):
     filename = serializers.SerializerMethodField()
     upload_filename = serializers.CharField(write_only=True, required=False)
     presigned_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
 
     class Meta:
         model = ExpenseReceipt
-        fields = ["id", "filename", "upload_filename", "s3_path", "presigned_url", "uploaded_at"]
+        fields = ["id", "filename", "upload_filename", "s3_path", "presigned_url", "thumbnail_url", "preview_url", "uploaded_at", "size", "content_type", "checksum", "verified_at"]
+        read_only_fields = ["size", "content_type", "checksum", "verified_at"]
 
     def get_filename(self, obj):
         return obj.s3_path.split("/")[-1] if obj.s3_path else None
@@ -37,14 +44,39 @@ class ExpenseReceiptSerializer(serializers.ModelSerializer):
         return obj.s3_path
     
     def get_presigned_url(self, obj):
+        presigned_urls = self.context.get('presigned_urls')
+        if presigned_urls is not None:
+            return presigned_urls.get(obj.s3_path)
         if self.context.get('include_presigned_url', False):
             if obj.s3_path:
                 if self.context.get('read_presigned_url', False):
-                    return generate_presigned_url(obj.s3_path, operation="get_object")
+                    return get_storage().presigned_url(obj.s3_path, operation="get_object")
                 else:
-                    return generate_presigned_url(obj.s3_path)
+                    return get_storage().presigned_url(obj.s3_path, operation="put_object")
         return None
 
+    def get_thumbnail_url(self, obj):
+        return self._get_read_url(obj.thumbnail_path)
+
+    def get_preview_url(self, obj):
+        return self._get_read_url(obj.preview_path)
+
+    def _get_read_url(self, path):
+        if not path:
+            return None
+        presigned_urls = self.context.get('presigned_urls')
+        if presigned_urls is not None:
+            return presigned_urls.get(path)
+        if self.context.get('include_presigned_url', False):
+            return get_storage().presigned_url(path, operation="get_object")
+        return None
+
+class ReportReceiptSerializer(ExpenseReceiptSerializer):
+    item_id = serializers.UUIDField(source='expense_item.item_id', read_only=True)
+
+    class Meta(ExpenseReceiptSerializer.Meta):
+        fields = ["id", "item_id", "filename", "s3_path", "presigned_url", "thumbnail_url", "preview_url", "uploaded_at", "size", "content_type", "checksum", "verified_at"]
+
 class ExpenseItemSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(source='item_id', read_only=True)
     justification = serializers.CharField(required=False, allow_blank=True)
@@ -59,6 +91,11 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
     mileage_rate = serializers.CharField(write_only=True, required=False, allow_null=True)
     receipts = ExpenseReceiptSerializer(many=True, required=False)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.context.get('omit_receipts', False):
+            self.fields.pop('receipts', None)
+
     def _get_instance(self, model, value=None, pk=None):
         if pk is not None:
             try:
@@ -66,15 +103,16 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
             except model.DoesNotExist:
                 raise ValidationError(f'Invalid input: {model.__name__} with ID "{pk}" does not exist.')
         elif value is not None:
-            try:
-                return model.objects.get(value=value)
-            except model.DoesNotExist:
+            instance = reference_index.get(model, value)
+            if instance is None:
                 raise ValidationError(f'Invalid input: {model.__name__} with value "{value}" does not exist.')
+            return instance
         return None
 
     class Meta:
         model = ExpenseItem
         fields = '__all__'
+        read_only_fields = ['amount', 'conversion_rate', 'converted_amount', 'policy_violations', 'policy_checked_at']
 
     def get_airline(self, obj):
         return obj.airline.value if obj.airline else None
@@ -94,48 +132,35 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
     def get_city(self, obj):
         return obj.city.value if obj.city else None
     
-    def _get_exchange_rate(self, from_currency, to_currency):
-        if from_currency == to_currency:
-            return Decimal(1)
-        try:
-            latest_rate = ExchangeRate.objects.latest('date_fetched')
-            from_rate = ExchangeRate.objects.get(target_currency=from_currency, date_fetched=latest_rate.date_fetched).rate
-            to_rate = ExchangeRate.objects.get(target_currency=to_currency, date_fetched=latest_rate.date_fetched).rate
-            return to_rate / from_rate
-        except ExchangeRate.DoesNotExist:
+    def _get_exchange_rate(self, from_currency, to_currency, on=None):
+        rate = fx.get_rate(from_currency, to_currency, on=on)
+        if rate is None:
             raise ValidationError(f'Exchange rate for {from_currency} to {to_currency} does not exist.')
+        return rate
         
-    def _get_hotel_base_rate(self, city):
-        try:
-            return HotelDailyBaseRate.objects.filter(city__iexact=city).first()
-        except HotelDailyBaseRate.DoesNotExist:
-            logger.error(f"HotelBaseRate does not exist for city: {city}")
-            pass
-        return None
+    def _get_hotel_base_rate(self, city, on=None):
+        return policy_rates.hotel_rate(city, on=on)
 
-    def _get_mileage_rate(self, org):
-        try:
-            return MileageRate.objects.filter(value__iexact=org).first()
-        except MileageRate.DoesNotExist:
-            logger.error(f"Mileage does not exist for org: {org}")
-            pass
-        return None
+    def _get_mileage_rate(self, org, on=None):
+        return policy_rates.mileage_rate(org, on=on)
         
-    def _update_report_amount(self, report, old_amount, new_amount, old_currency, new_currency):
-        print(old_amount, new_amount, old_currency, new_currency)
-        # Subtract the old amount
-        if old_amount is not None:
-            old_rate = self._get_exchange_rate(old_currency, report.report_currency)
-            old_converted_amount = old_amount * old_rate
-            report.report_amount -= old_converted_amount
-
-        # Add the new amount
-        if new_amount is not None:
-            new_rate = self._get_exchange_rate(new_currency, report.report_currency)
-            new_converted_amount = new_amount * new_rate
-            report.report_amount += new_converted_amount
-        
-        report.save()
+    def _get_conversion(self, report, amount, currency, expense_date=None):
+        rate = self._get_exchange_rate(currency, report.report_currency, on=expense_date)
+        return {
+            'amount': amount.quantize(CENT),
+            'conversion_rate': rate,
+            'exchange_rate': rate,
+            'converted_amount': (amount * rate).quantize(CENT),
+        }
+
+    def _get_converted_amount(self, instance):
+        if instance.converted_amount is not None:
+            return instance.converted_amount
+        rate = self._get_exchange_rate(instance.receipt_currency, instance.report.report_currency, on=instance.expense_date)
+        return (Decimal(instance.receipt_amount) * rate).quantize(CENT)
+
+    def _update_report_amount(self, report, old_converted_amount, new_converted_amount):
+        report.apply_amount_delta((new_converted_amount or Decimal(0)) - (old_converted_amount or Decimal(0)))
 
     def create(self, validated_data):
         report = validated_data['report']
@@ -148,43 +173,54 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
         validated_data['car_type'] = self._get_instance(CarType, validated_data.pop('car_type', None))
         validated_data['meal_category'] = self._get_instance(MealCategory, validated_data.pop('meal_category', None))
         validated_data['relationship_to_pai'] = self._get_instance(RelationshipToPAI, validated_data.pop('relationship_to_pai', None))
-        validated_data['mileage_rate'] = self._get_mileage_rate(self.context['request'].user.company_code) if expense_type == "Mileage" else None
+        expense_date = validated_data.get('expense_date')
+        validated_data['mileage_rate'] = self._get_mileage_rate(self.context['request'].user.company_code, on=expense_date) if expense_type == "Mileage" else None
 
         city = validated_data.pop('city', None)
         validated_data['city'] = self._get_instance(City, city)
-        validated_data['hotel_daily_base_rate'] = self._get_hotel_base_rate(city) if expense_type == "Hotel" else None
+        validated_data['hotel_daily_base_rate'] = self._get_hotel_base_rate(city, on=expense_date) if expense_type == "Hotel" else None
         
+        validated_data.update(self._get_conversion(report, receipt_amount, receipt_currency, validated_data.get('expense_date')))
+
         receipts_data = validated_data.pop("receipts", [])
         logger.info(f"Saving Validated Data: {validated_data}")
-        expense_item = super().create(validated_data)
-        self._process_receipts(expense_item, receipts_data)
-        self._update_report_amount(report, None, receipt_amount, None, receipt_currency)
+        with transaction.atomic():
+            expense_item = super().create(validated_data)
+            self._process_receipts(expense_item, receipts_data)
+            self._update_report_amount(report, None, expense_item.converted_amount)
         return expense_item
     
     def update(self, instance, validated_data):
         old_receipt_amount = Decimal(instance.receipt_amount)
         old_receipt_currency = instance.receipt_currency
+        old_converted_amount = self._get_converted_amount(instance)
 
         new_receipt_amount = Decimal(validated_data.get('receipt_amount', old_receipt_amount))
         new_receipt_currency = validated_data.get('receipt_currency', old_receipt_currency)
+        new_expense_date = validated_data.get('expense_date', instance.expense_date)
         expense_type = validated_data['expense_type'] or instance.expense_type
-        validated_data['airline'] = self._get_instance(Airline, value=validated_data.pop('airline', None)) or instance.airline
-        validated_data['rental_agency'] = self._get_instance(RentalAgency, value=validated_data.pop('rental_agency', None)) or instance.rental_agency
-        validated_data['car_type'] = self._get_instance(CarType, value=validated_data.pop('car_type', None)) or instance.car_type
-        validated_data['meal_category'] = self._get_instance(MealCategory, value=validated_data.pop('meal_category', None)) or instance.meal_category
-        validated_data['relationship_to_pai'] = self._get_instance(RelationshipToPAI, value=validated_data.pop('relationship_to_pai', None)) or instance.relationship_to_pai
-        validated_data['mileage_rate'] = self._get_mileage_rate(self.context['request'].user.company_code) if expense_type == "Mileage" else None
+        # Fields that weren't sent (or resolve to nothing) keep their current value without loading it.
+        for field, model in (('airline', Airline), ('rental_agency', RentalAgency), ('car_type', CarType), ('meal_category', MealCategory), ('relationship_to_pai', RelationshipToPAI)):
+            resolved = self._get_instance(model, value=validated_data.pop(field, None))
+            if resolved is not None:
+                validated_data[field] = resolved
+        validated_data['mileage_rate'] = self._get_mileage_rate(self.context['request'].user.company_code, on=new_expense_date) if expense_type == "Mileage" else None
 
         city = validated_data.pop('city', None)
-        validated_data['city'] = self._get_instance(City, city) or instance.city
-        validated_data['hotel_daily_base_rate'] = self._get_hotel_base_rate(city) if expense_type == "Hotel" else None
+        if city is not None:
+            validated_data['city'] = self._get_instance(City, city)
+        validated_data['hotel_daily_base_rate'] = self._get_hotel_base_rate(city, on=new_expense_date) if expense_type == "Hotel" else None
+
+        if (new_receipt_amount, new_receipt_currency, new_expense_date) != (old_receipt_amount, old_receipt_currency, instance.expense_date) or instance.converted_amount is None:
+            validated_data.update(self._get_conversion(instance.report, new_receipt_amount, new_receipt_currency, new_expense_date))
 
         receipts_data = validated_data.pop("receipts", [])
         logger.info(f"Saving Validated Data: {validated_data}")
-        updated_expense_item = super().update(instance, validated_data)
+        with transaction.atomic():
+            updated_expense_item = super().update(instance, validated_data)
 
-        self._process_receipts(updated_expense_item, receipts_data, delete_old=True)
-        self._update_report_amount(instance.report, old_receipt_amount, new_receipt_amount, old_receipt_currency, new_receipt_currency)
+            self._process_receipts(updated_expense_item, receipts_data, delete_old=True)
+            self._update_report_amount(instance.report, old_converted_amount, updated_expense_item.converted_amount)
         return updated_expense_item
 
     def to_representation(self, instance):
@@ -211,7 +247,7 @@ class ExpenseItemSerializer(serializers.ModelSerializer):
         epoch_timestamp = int(time.time())
 
         for filename in new_receipts:
-            object_name = f'{report_id}/{expense_id}/{epoch_timestamp}_{filename}'
+            object_name = ExpenseReceipt.build_s3_path(report_id, expense_id, filename, epoch_timestamp)
             ExpenseReceipt.objects.create(expense_item=expense_item, s3_path=object_name)
 
 
@@ -226,6 +262,7 @@ class ExpenseReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = ExpenseReport
         fields = '__all__'
+        read_only_fields = ['claimed_by', 'claimed_at']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
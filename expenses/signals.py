@@ -0,0 +1,12 @@
+# signals.py
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ExpenseReceipt
+from .receipt_cleanup import queue_s3_deletes
+
+
+@receiver(post_delete, sender=ExpenseReceipt)
+def queue_receipt_object_delete(sender, instance, **kwargs):
+    # Runs for direct, queryset and CASCADE deletes alike, inside the deleting transaction.
+    queue_s3_deletes([instance.s3_path, instance.thumbnail_path, instance.preview_path])
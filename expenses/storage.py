@@ -0,0 +1,356 @@
+# storage.py
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .utils import generate_presigned_url, get_bucket_name, get_s3_client
+
+logger = logging.getLogger(__name__)
+
+# S3 DeleteObjects accepts at most 1000 keys per call; listings use the same page size.
+S3_DELETE_BATCH_SIZE = 1000
+LIST_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+def chunked(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def validate_key(key):
+    """Reject keys that could climb out of their <report_id>/<item_id>/ prefix once a path or URL is normalized."""
+    if not key or key.startswith("/") or ".." in key or "\\" in key or "\x00" in key:
+        raise StorageError(f'Invalid key "{key}".')
+    return key
+
+
+def get_checksum(head):
+    for algorithm in ("SHA256", "SHA1", "CRC32C", "CRC32"):
+        if head.get(f"Checksum{algorithm}"):
+            return f"{algorithm.lower()}:{head[f'Checksum{algorithm}']}"
+    return f'etag:{head.get("ETag", "").strip(chr(34))}'
+
+
+class S3ReceiptStorage:
+    """Receipts in the AWS_S3_BUCKET_NAME bucket, through the shared pooled client.
+
+    Presigned URLs go straight to S3; read URLs are cached by utils.generate_presigned_url.
+    """
+
+    def presigned_url(self, key, operation="get_object", expiration=300, params=None):
+        if operation != "get_object":
+            validate_key(key)
+        return generate_presigned_url(key, operation=operation, expiration=expiration, params=params)
+
+    def presigned_urls(self, keys, operation="get_object", expiration=300):
+        return {key: self.presigned_url(key, operation=operation, expiration=expiration) for key in set(keys)}
+
+    def put(self, key, data, content_type=None, cache_control=None):
+        kwargs = {"Bucket": get_bucket_name(), "Key": validate_key(key), "Body": data}
+        if content_type:
+            kwargs["ContentType"] = content_type
+        if cache_control:
+            kwargs["CacheControl"] = cache_control
+        get_s3_client().put_object(**kwargs)
+
+    def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        """Return (size, content_type, iterator of byte chunks)."""
+        try:
+            response = get_s3_client().get_object(Bucket=get_bucket_name(), Key=key)
+        except Exception as e:
+            raise StorageError(f"Failed to read {key}: {e}")
+        return response.get("ContentLength"), response.get("ContentType"), response["Body"].iter_chunks(chunk_size)
+
+    def head(self, key):
+        """Return {size, content_type, checksum, last_modified}, or None if the object is missing."""
+        try:
+            head = get_s3_client().head_object(Bucket=get_bucket_name(), Key=key, ChecksumMode="ENABLED")
+        except Exception as e:
+            logger.warning(f"HEAD {key} failed: {e}")
+            return None
+        return {
+            "size": head.get("ContentLength"),
+            "content_type": head.get("ContentType"),
+            "checksum": get_checksum(head),
+            "last_modified": head.get("LastModified"),
+        }
+
+    def delete(self, key):
+        get_s3_client().delete_object(Bucket=get_bucket_name(), Key=key)
+
+    def delete_many(self, keys):
+        """Delete keys with DeleteObjects, up to 1000 per call. Returns {key: error} for failures."""
+        s3_client = get_s3_client()
+        errors = {}
+        for chunk in chunked(list(keys), S3_DELETE_BATCH_SIZE):
+            try:
+                response = s3_client.delete_objects(
+                    Bucket=get_bucket_name(),
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+                )
+            except Exception as e:
+                logger.error(f"Failed to delete {len(chunk)} S3 objects: {e}")
+                errors.update({key: str(e) for key in chunk})
+                continue
+            for error in response.get("Errors", []):
+                errors[error["Key"]] = f'{error.get("Code")}: {error.get("Message")}'
+        return errors
+
+    def list(self, prefix=""):
+        """Yield pages of {key, size, last_modified} under `prefix`."""
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=get_bucket_name(), Prefix=prefix, PaginationConfig={"PageSize": LIST_PAGE_SIZE}):
+            yield [
+                {"key": obj["Key"], "size": obj["Size"], "last_modified": obj["LastModified"]}
+                for obj in page.get("Contents", [])
+            ]
+
+    def create_multipart_upload(self, key, content_type=None):
+        kwargs = {"Bucket": get_bucket_name(), "Key": validate_key(key)}
+        if content_type:
+            kwargs["ContentType"] = content_type
+        return get_s3_client().create_multipart_upload(**kwargs)["UploadId"]
+
+    def list_parts(self, key, upload_id):
+        paginator = get_s3_client().get_paginator("list_parts")
+        parts = []
+        for page in paginator.paginate(Bucket=get_bucket_name(), Key=key, UploadId=upload_id):
+            parts.extend(
+                {"part_number": part["PartNumber"], "etag": part["ETag"], "size": part["Size"]}
+                for part in page.get("Parts", [])
+            )
+        return parts
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        multipart = {"Parts": [{"PartNumber": part["part_number"], "ETag": part["etag"]} for part in parts]}
+        get_s3_client().complete_multipart_upload(Bucket=get_bucket_name(), Key=key, UploadId=upload_id, MultipartUpload=multipart)
+
+    def abort_multipart_upload(self, key, upload_id):
+        get_s3_client().abort_multipart_upload(Bucket=get_bucket_name(), Key=key, UploadId=upload_id)
+
+
+class LocalReceiptStorage:
+    """Receipts on local disk under RECEIPT_STORAGE_ROOT, for single-machine and on-prem setups.
+
+    Presigned URLs are signed tokens served by ReceiptStorageObjectView, so clients use
+    the same upload and download flow as with S3. Multipart parts are staged under
+    .multipart/<upload_id>/ until the upload is completed or aborted.
+    """
+
+    signing_salt = "expenses.storage.local"
+    multipart_dir = ".multipart"
+
+    def __init__(self, root=None, base_url=None):
+        self.root = os.path.abspath(
+            root or getattr(settings, "RECEIPT_STORAGE_ROOT", None) or os.path.join(settings.MEDIA_ROOT, "receipts")
+        )
+        self.base_url = (base_url if base_url is not None else getattr(settings, "RECEIPT_STORAGE_BASE_URL", "")).rstrip("/")
+
+    def path(self, key):
+        validate_key(key)
+        path = os.path.abspath(os.path.join(self.root, key))
+        # The normalized path must still be the key itself under the root, so it keeps its prefix.
+        relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+        if relative != key.rstrip("/") or key.startswith(self.multipart_dir):
+            raise StorageError(f'Invalid key "{key}".')
+        return path
+
+    def upload_dir(self, upload_id):
+        if not upload_id or not upload_id.isalnum():
+            raise StorageError(f'Invalid upload id "{upload_id}".')
+        return os.path.join(self.root, self.multipart_dir, upload_id)
+
+    def presigned_url(self, key, operation="get_object", expiration=300, params=None):
+        self.path(key)
+        payload = {"key": key, "op": operation, "exp": int(time.time() + expiration)}
+        if params:
+            payload["upload_id"] = params.get("UploadId")
+            payload["part_number"] = params.get("PartNumber")
+        token = signing.dumps(payload, salt=self.signing_salt, compress=True)
+        return self.base_url + reverse("receipt-storage-object", args=[token])
+
+    def presigned_urls(self, keys, operation="get_object", expiration=300):
+        return {key: self.presigned_url(key, operation=operation, expiration=expiration) for key in set(keys)}
+
+    def load_token(self, token):
+        """Return the payload of a URL made by presigned_url(), or None if it is forged or expired."""
+        try:
+            payload = signing.loads(token, salt=self.signing_salt)
+        except signing.BadSignature:
+            return None
+        if payload.get("exp", 0) < time.time():
+            return None
+        return payload
+
+    def write(self, path, chunks):
+        """Write chunks to `path` through a temp file so readers never see a partial object."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        md5 = hashlib.md5()
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    md5.update(chunk)
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return f'"{md5.hexdigest()}"'
+
+    def put(self, key, data, content_type=None, cache_control=None):
+        return self.write(self.path(key), [data])
+
+    def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            raise StorageError(f"Failed to read {key}: {e}")
+
+        def chunks():
+            with open(path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+
+        return size, mimetypes.guess_type(key)[0], chunks()
+
+    def head(self, key):
+        try:
+            path = self.path(key)
+            stat = os.stat(path)
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(STREAM_CHUNK_SIZE):
+                    sha256.update(chunk)
+        except (OSError, StorageError) as e:
+            logger.warning(f"HEAD {key} failed: {e}")
+            return None
+        return {
+            "size": stat.st_size,
+            "content_type": mimetypes.guess_type(key)[0] or "binary/octet-stream",
+            "checksum": f"sha256:{base64.b64encode(sha256.digest()).decode()}",
+            "last_modified": datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+        }
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, keys):
+        errors = {}
+        for key in keys:
+            try:
+                self.delete(key)
+            except (OSError, StorageError) as e:
+                errors[key] = str(e)
+        return errors
+
+    def list(self, prefix=""):
+        page = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and self.multipart_dir in dirnames:
+                dirnames.remove(self.multipart_dir)
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if not key.startswith(prefix):
+                    continue
+                stat = os.stat(path)
+                page.append({"key": key, "size": stat.st_size, "last_modified": datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc)})
+                if len(page) == LIST_PAGE_SIZE:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def create_multipart_upload(self, key, content_type=None):
+        self.path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir(upload_id))
+        with open(os.path.join(self.upload_dir(upload_id), "key"), "w") as f:
+            f.write(key)
+        return upload_id
+
+    def check_upload(self, key, upload_id):
+        upload_dir = self.upload_dir(upload_id)
+        try:
+            with open(os.path.join(upload_dir, "key")) as f:
+                if f.read() == key:
+                    return upload_dir
+        except OSError:
+            pass
+        raise StorageError(f'No upload "{upload_id}" for "{key}".')
+
+    def put_part(self, key, upload_id, part_number, chunks):
+        upload_dir = self.check_upload(key, upload_id)
+        return self.write(os.path.join(upload_dir, f"{int(part_number):05d}.part"), chunks)
+
+    def list_parts(self, key, upload_id):
+        upload_dir = self.check_upload(key, upload_id)
+        parts = []
+        for filename in sorted(os.listdir(upload_dir)):
+            if filename.endswith(".part"):
+                path = os.path.join(upload_dir, filename)
+                md5 = hashlib.md5()
+                with open(path, "rb") as f:
+                    while chunk := f.read(STREAM_CHUNK_SIZE):
+                        md5.update(chunk)
+                parts.append({"part_number": int(filename[:-5]), "etag": f'"{md5.hexdigest()}"', "size": os.path.getsize(path)})
+        return parts
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        upload_dir = self.check_upload(key, upload_id)
+        etags = {part["part_number"]: part["etag"] for part in self.list_parts(key, upload_id)}
+        for part in parts:
+            if etags.get(part["part_number"], "").strip('"') != str(part["etag"]).strip('"'):
+                raise StorageError(f'Part {part["part_number"]} of "{key}" is missing or has a different ETag.')
+
+        def chunks():
+            for part in parts:
+                with open(os.path.join(upload_dir, f'{part["part_number"]:05d}.part'), "rb") as f:
+                    while chunk := f.read(STREAM_CHUNK_SIZE):
+                        yield chunk
+
+        self.write(self.path(key), chunks())
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def abort_multipart_upload(self, key, upload_id):
+        shutil.rmtree(self.check_upload(key, upload_id), ignore_errors=True)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide receipt storage named by RECEIPT_STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = getattr(settings, "RECEIPT_STORAGE_BACKEND", "expenses.storage.S3ReceiptStorage")
+                _storage = import_string(backend)()
+    return _storage
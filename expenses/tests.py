@@ -1,3 +1,262 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from common.models import Airline, CarType, City, HotelDailyBaseRate, MealCategory, MileageRate, RelationshipToPAI, RentalAgency
+from common.policy_rates import policy_rates
+from common.reference_data import reference_index, reference_versions
+from users.models import User
+from .models import ExpenseItem, ExpenseReceipt, ExpenseReport
+from .report_numbers import ReportNumberAllocator, report_number_allocator
+
+
+def run_in_threads(target, count):
+    """Start `count` threads on target(index) at the same moment and return what they raised."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def worker(index):
+        try:
+            barrier.wait()
+            target(index)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentTestCase(TransactionTestCase):
+    """Base for tests that write from several threads at once."""
+
+    def setUp(self):
+        # Shared-cache in-memory SQLite fails concurrent writers at once instead of making them wait.
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs a database that queues concurrent writers")
+
+
+def create_user(email):
+    return User.objects.create(email=email, first_name="Test", last_name="User", company_code="PAI", is_active=True)
+
+
+def create_report(user, **kwargs):
+    defaults = {"purpose": "Trip", "expense_type": "Travel", "payment_method": "Cash", "report_currency": "USD", "report_amount": 0}
+    return ExpenseReport.objects.create(user=user, **{**defaults, **kwargs})
+
+
+class ReportNumberConcurrencyTests(ConcurrentTestCase):
+    threads = 16
+    per_thread = 100
+    block_size = 10
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("numbers@example.com")
+        report_number_allocator.reset()
+
+    def assertUniqueAndDense(self, numbers):
+        self.assertEqual(len(numbers), self.threads * self.per_thread)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        numbers = sorted(numbers)
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + len(numbers))))
+
+    def test_concurrent_reports_get_unique_dense_numbers(self):
+        def create_reports(index):
+            for _ in range(self.per_thread):
+                create_report(self.user)
+
+        self.assertEqual(run_in_threads(create_reports, self.threads), [])
+        self.assertUniqueAndDense([int(number) for number in ExpenseReport.objects.values_list("report_number", flat=True)])
+
+    def test_concurrent_blocks_are_unique_and_gap_free(self):
+        # One allocator per thread stands in for one per worker process.
+        allocators = [ReportNumberAllocator(block_size=self.block_size) for _ in range(self.threads)]
+        drawn = [[] for _ in range(self.threads)]
+
+        def draw(index):
+            for _ in range(self.per_thread):
+                drawn[index].append(allocators[index].next())
+
+        self.assertEqual(run_in_threads(draw, self.threads), [])
+        for numbers in drawn:
+            for start in range(0, self.per_thread, self.block_size):
+                block = numbers[start:start + self.block_size]
+                self.assertEqual(block, list(range(block[0], block[0] + self.block_size)))
+        self.assertUniqueAndDense([number for numbers in drawn for number in numbers])
+
+
+class ReportAmountConcurrencyTests(ConcurrentTestCase):
+    threads = 8
+    per_thread = 5
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("amounts@example.com")
+        self.report = create_report(self.user)
+
+    def test_parallel_item_writes_keep_report_amount_exact(self):
+        def add_items(index):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            for number in range(self.per_thread):
+                response = client.post(f"/api/reports/{self.report.report_id}/items", {
+                    "expense_type": "Meal", "receipt_amount": f"{index + 1}.{number:02d}",
+                    "receipt_currency": "USD", "payment_method": "Cash",
+                }, format="json")
+                assert response.status_code == 201, response.data
+
+        self.assertEqual(run_in_threads(add_items, self.threads), [])
+        expected = sum(Decimal(f"{index + 1}.{number:02d}") for index in range(self.threads) for number in range(self.per_thread))
+        self.report.refresh_from_db()
+        self.assertEqual(ExpenseItem.objects.filter(report=self.report).count(), self.threads * self.per_thread)
+        self.assertEqual(self.report.report_amount, expected)
+        self.assertEqual(self.report.compute_report_amount(), expected)
+
+
+class ReportAmountReconcileTests(TestCase):
+    def setUp(self):
+        self.report = create_report(create_user("reconcile@example.com"))
+        ExpenseItem.objects.create(
+            report=self.report, expense_type="Meal", receipt_amount="12.50", receipt_currency="USD",
+            payment_method="Cash", converted_amount=Decimal("12.50"),
+        )
+
+    def test_command_fixes_drifted_reports(self):
+        ExpenseReport.objects.filter(pk=self.report.pk).update(report_amount=Decimal("99"))
+        call_command("reconcile_report_amounts")
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.report_amount, Decimal("12.50"))
+
+    def test_items_without_converted_amount_are_not_summed_as_zero(self):
+        ExpenseItem.objects.filter(report=self.report).update(converted_amount=None)
+        ExpenseReport.objects.filter(pk=self.report.pk).update(report_amount=Decimal("12.50"))
+        self.assertIsNone(self.report.compute_report_amount())
+        self.report.reconcile_report_amount()
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.report_amount, Decimal("12.50"))
+
+
+class ExpenseItemListQueryTests(TestCase):
+    def setUp(self):
+        self.user = create_user("items@example.com")
+        self.report = create_report(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.lookups = {
+            "airline": Airline.objects.create(value="Air Canada"),
+            "rental_agency": RentalAgency.objects.create(value="Hertz"),
+            "car_type": CarType.objects.create(value="SUV"),
+            "meal_category": MealCategory.objects.create(value="Dinner"),
+            "relationship_to_pai": RelationshipToPAI.objects.create(value="Customer"),
+            "city": City.objects.create(value="Paris"),
+        }
+
+    def add_items(self, count):
+        for _ in range(count):
+            item = ExpenseItem.objects.create(
+                report=self.report, expense_type="Meal", receipt_amount="10", receipt_currency="USD",
+                payment_method="Cash", converted_amount=Decimal("10"), **self.lookups,
+            )
+            for number in range(2):
+                ExpenseReceipt.objects.create(expense_item=item, s3_path=f"{self.report.report_id}/{item.item_id}/{number}.jpg")
+
+    def list_items(self):
+        response = self.client.get(f"/api/reports/{self.report.report_id}/items")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_item_list_query_count_does_not_grow_with_items(self):
+        self.add_items(1)
+        with CaptureQueriesContext(connection) as one_item:
+            self.list_items()
+
+        self.add_items(4)
+        with self.assertNumQueries(len(one_item)):
+            response = self.list_items()
+        items = response.data["results"] if "results" in response.data else response.data
+        self.assertEqual(len(items), 5)
+        self.assertEqual({item["airline"] for item in items}, {"Air Canada"})
+
+
+class ExpenseItemCreateQueryTests(TestCase):
+    lookups = {
+        "airline": "air canada", "rental_agency": "HERTZ", "car_type": "suv",
+        "meal_category": "dinner", "relationship_to_pai": "customer", "city": "paris",
+    }
+
+    def setUp(self):
+        reference_versions.clear()
+        reference_index.clear()
+        policy_rates.clear()
+        self.user = create_user("create@example.com")
+        self.report = create_report(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Airline.objects.create(value="Air Canada")
+        RentalAgency.objects.create(value="Hertz")
+        CarType.objects.create(value="SUV")
+        MealCategory.objects.create(value="Dinner")
+        RelationshipToPAI.objects.create(value="Customer")
+        City.objects.create(value="Paris")
+
+    def create_item(self, **lookups):
+        response = self.client.post(f"/api/reports/{self.report.report_id}/items", {
+            "expense_type": "Meal", "receipt_amount": "10", "receipt_currency": "USD", "payment_method": "Cash", **lookups,
+        }, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def test_item_create_resolves_lookups_without_queries(self):
+        self.create_item(**self.lookups)
+        with CaptureQueriesContext(connection) as without_lookups:
+            self.create_item()
+
+        with self.assertNumQueries(len(without_lookups)):
+            response = self.create_item(**self.lookups)
+        item = ExpenseItem.objects.get(item_id=response.data["id"])
+        self.assertEqual(item.airline.value, "Air Canada")
+        self.assertEqual(item.city.value, "Paris")
+
+    def test_item_create_resolves_policy_rates_without_queries(self):
+        HotelDailyBaseRate.objects.create(country="France", city="Paris", amount=200, currency="EUR")
+        MileageRate.objects.create(rate="0.58", value="PAI")
+        self.create_item(expense_type="Hotel", city="paris")
+        self.create_item(expense_type="Mileage")
+        with CaptureQueriesContext(connection) as meal:
+            self.create_item(city="paris")
+
+        with self.assertNumQueries(len(meal)):
+            hotel = self.create_item(expense_type="Hotel", city="paris")
+        with self.assertNumQueries(len(meal)):
+            mileage = self.create_item(expense_type="Mileage")
+        self.assertEqual(ExpenseItem.objects.get(item_id=hotel.data["id"]).hotel_daily_base_rate.amount, 200)
+        self.assertEqual(ExpenseItem.objects.get(item_id=mileage.data["id"]).mileage_rate.rate, Decimal("0.58"))
+
+    def bulk_create(self, count):
+        operations = [{"op": "create", "data": {
+            "expense_type": "Meal", "receipt_amount": "10", "receipt_currency": "USD", "payment_method": "Cash", **self.lookups,
+        }} for _ in range(count)]
+        response = self.client.post(f"/api/reports/{self.report.report_id}/items/bulk", operations, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_bulk_create_query_count_does_not_grow_with_operations(self):
+        self.bulk_create(1)
+        with CaptureQueriesContext(connection) as one_operation:
+            self.bulk_create(1)
+
+        # 20 rows still fit in one INSERT under SQLite's 999-parameter limit.
+        with self.assertNumQueries(len(one_operation)):
+            self.bulk_create(20)
+        self.assertEqual(ExpenseItem.objects.filter(report=self.report, city__value="Paris").count(), 22)
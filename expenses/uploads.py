@@ -0,0 +1,181 @@
+# uploads.py
+import logging
+import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .derivatives import schedule_derivatives
+from .models import ExpenseItem, ExpenseReceipt
+from .storage import get_storage
+from .utils import bulk_create_with_pks
+
+logger = logging.getLogger(__name__)
+
+# S3 requires every part but the last to be at least 5 MiB, and allows at most 10000 parts.
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_part_size(size=None):
+    part_size = max(int(getattr(settings, "RECEIPT_UPLOAD_PART_SIZE", 8 * 1024 * 1024)), MIN_PART_SIZE)
+    if size:
+        part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    return part_size
+
+
+def get_upload_url_expiration():
+    return int(getattr(settings, "RECEIPT_UPLOAD_URL_EXPIRATION", 3600))
+
+
+def check_key(s3_path, report_id, item_id=None):
+    """Reject keys outside the report (and item) the caller was authorised for."""
+    prefix = f"{report_id}/{item_id}/" if item_id else f"{report_id}/"
+    if not s3_path or not s3_path.startswith(prefix) or ".." in s3_path:
+        raise UploadError(f'Invalid s3_path "{s3_path}" for this {"item" if item_id else "report"}.')
+
+
+def start_multipart_upload(item, filename, content_type=None, size=None):
+    """Create the multipart upload and sign every part up front when the size is known."""
+    s3_path = ExpenseReceipt.build_s3_path(item.report.report_id, item.item_id, filename)
+    upload_id = get_storage().create_multipart_upload(s3_path, content_type=content_type)
+
+    part_size = get_part_size(size)
+    upload = {"s3_path": s3_path, "upload_id": upload_id, "part_size": part_size}
+    if size:
+        part_count = max(math.ceil(size / part_size), 1)
+        upload["part_count"] = part_count
+        upload["parts"] = presign_upload_parts(s3_path, upload_id, range(1, part_count + 1))
+    return upload
+
+
+def presign_upload_parts(s3_path, upload_id, part_numbers):
+    storage = get_storage()
+    expiration = get_upload_url_expiration()
+    parts = []
+    for part_number in part_numbers:
+        part_number = int(part_number)
+        if not 1 <= part_number <= MAX_PARTS:
+            raise UploadError(f"Invalid part number {part_number}.")
+        url = storage.presigned_url(
+            s3_path, operation="upload_part", expiration=expiration,
+            params={"UploadId": upload_id, "PartNumber": part_number},
+        )
+        parts.append({"part_number": part_number, "url": url})
+    return parts
+
+
+def list_uploaded_parts(s3_path, upload_id):
+    """Parts storage already has, so a client can resume by uploading only the rest."""
+    return get_storage().list_parts(s3_path, upload_id)
+
+
+def complete_multipart_upload(s3_path, upload_id, parts=None):
+    """Complete with the client's part list, or with whatever storage has if none was sent."""
+    if not parts:
+        parts = list_uploaded_parts(s3_path, upload_id)
+    if not parts:
+        raise UploadError(f'No parts uploaded for "{s3_path}".')
+    parts = sorted(
+        ({"part_number": int(part["part_number"]), "etag": part["etag"]} for part in parts),
+        key=lambda part: part["part_number"],
+    )
+    get_storage().complete_multipart_upload(s3_path, upload_id, parts)
+
+
+def abort_multipart_upload(s3_path, upload_id):
+    get_storage().abort_multipart_upload(s3_path, upload_id)
+
+
+def head_objects(s3_paths, workers=None):
+    """HEAD many keys concurrently; missing objects map to None."""
+    s3_paths = list(dict.fromkeys(s3_paths))
+    if not s3_paths:
+        return {}
+    workers = workers or min(len(s3_paths), int(getattr(settings, "AWS_S3_MAX_POOL_CONNECTIONS", 20)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(s3_paths, executor.map(get_storage().head, s3_paths)))
+
+
+def apply_head(receipt, head, verified_at):
+    receipt.size = head["size"]
+    receipt.content_type = head["content_type"]
+    receipt.checksum = head["checksum"]
+    receipt.verified_at = verified_at
+
+
+def complete_receipt_uploads(report, entries):
+    """Finish a batch of uploads for one report and record what landed in storage.
+
+    Each entry is {s3_path} for a single presigned PUT or {s3_path, upload_id, parts?} for a
+    multipart upload. Multipart uploads are completed first, then every object is checked
+    with one concurrent round of HEAD calls, and receipts are created or updated in bulk.
+    Returns one result per entry, in order.
+    """
+    results = [{"index": index, "s3_path": entry.get("s3_path") if isinstance(entry, dict) else None} for index, entry in enumerate(entries)]
+    item_ids = set()
+    for result in results:
+        parts = (result["s3_path"] or "").split("/")
+        if len(parts) == 3:
+            try:
+                item_ids.add(uuid.UUID(parts[1]))
+            except ValueError:
+                pass
+    items = {str(item.item_id): item for item in ExpenseItem.objects.filter(report=report, item_id__in=item_ids)} if item_ids else {}
+
+    pending = {}
+    for entry, result in zip(entries, results):
+        s3_path = result["s3_path"]
+        try:
+            check_key(s3_path, report.report_id)
+            item = items.get(s3_path.split("/")[1])
+            if item is None or s3_path.count("/") != 2:
+                raise UploadError("Expense item not found in this report.")
+            if s3_path in pending:
+                raise UploadError("Duplicate s3_path in this batch.")
+            if entry.get("upload_id"):
+                complete_multipart_upload(s3_path, entry["upload_id"], entry.get("parts"))
+        except UploadError as e:
+            result["error"] = str(e)
+            continue
+        except Exception as e:
+            logger.error(f"Failed to complete upload {s3_path}: {e}")
+            result["error"] = "Failed to complete upload."
+            continue
+        pending[s3_path] = (item, result)
+
+    receipts = {
+        receipt.s3_path: receipt
+        for receipt in ExpenseReceipt.objects.filter(expense_item__report=report, s3_path__in=list(pending))
+    } if pending else {}
+    heads = head_objects(pending)
+    now = timezone.now()
+    created, updated = [], []
+    for s3_path, (item, result) in pending.items():
+        head = heads.get(s3_path)
+        if head is None:
+            result["error"] = "Object not found in storage."
+            continue
+        receipt = receipts.get(s3_path)
+        if receipt is None:
+            receipt = ExpenseReceipt(expense_item=item, s3_path=s3_path)
+            created.append(receipt)
+        else:
+            updated.append(receipt)
+        apply_head(receipt, head, now)
+        result.update(status="verified", size=receipt.size, content_type=receipt.content_type, checksum=receipt.checksum)
+
+    with transaction.atomic():
+        if created:
+            bulk_create_with_pks(ExpenseReceipt, created, "s3_path")
+        if updated:
+            ExpenseReceipt.objects.bulk_update(updated, ["size", "content_type", "checksum", "verified_at"])
+        receipt_ids = [receipt.pk for receipt in created + updated if receipt.pk]
+        transaction.on_commit(lambda: schedule_derivatives(receipt_ids))
+    return results
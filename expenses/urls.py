@@ -1,22 +1,32 @@
 from django.urls import path, include
-from .views import ExpenseReportListCreateView, ExpenseReportDetailView, SubmitReportView, UpdateReportStatusView
-from .expense_item_views import ExpenseItemFileDeleteView, ExpenseItemFileDownloadView, ExpenseItemListCreateView, ExpenseItemDetailView
+from .views import BatchUpdateReportStatusView, ClaimReportsView, ExpenseExportView, ExpenseReportListCreateView, ExpenseReportDetailView, ReportPolicyViolationsView, SubmitReportView, UpdateReportStatusView
+from .expense_item_views import ExpenseItemBulkView, ExpenseItemFileDeleteView, ExpenseItemFileDownloadView, ExpenseItemListCreateView, ExpenseItemDetailView, ExpenseItemUploadPartsView, ExpenseItemUploadView, ExpenseReceiptCompleteView, ExpenseReportReceiptsView, ReceiptStorageObjectView
 
 report_item_patterns = [
     path('', ExpenseItemListCreateView.as_view(), name='expense-item-list-create'),
+    path('/bulk', ExpenseItemBulkView.as_view(), name='expense-item-bulk'),
     path('/<uuid:item_id>', ExpenseItemDetailView.as_view(), name='expense-item-detail'),
     path('/<uuid:item_id>/download-receipt', ExpenseItemFileDownloadView.as_view(), name='expense-item-file-download'),
+    path('/<uuid:item_id>/uploads', ExpenseItemUploadView.as_view(), name='expense-item-upload'),
+    path('/<uuid:item_id>/uploads/parts', ExpenseItemUploadPartsView.as_view(), name='expense-item-upload-parts'),
     path('/<uuid:item_id>/delete-receipt', ExpenseItemFileDeleteView.as_view(), name='expense-item-file-delete'),
 ]
 
 report_patterns = [
     path('', ExpenseReportListCreateView.as_view(), name='expense-report-list-create'),
+    path('/status', BatchUpdateReportStatusView.as_view(), name='batch-update-report-status'),
+    path('/claim', ClaimReportsView.as_view(), name='claim-reports'),
+    path('/export', ExpenseExportView.as_view(), name='expense-export'),
     path('/<uuid:report_id>', ExpenseReportDetailView.as_view(), name='expense-report-detail'),
     path('/<uuid:report_id>/submit', SubmitReportView.as_view(), name='submit-report'),
     path('/<uuid:report_id>/status', UpdateReportStatusView.as_view(), name='update-report-status'),
+    path('/<uuid:report_id>/violations', ReportPolicyViolationsView.as_view(), name='report-policy-violations'),
+    path('/<uuid:report_id>/receipts', ExpenseReportReceiptsView.as_view(), name='expense-report-receipts'),
+    path('/<uuid:report_id>/receipts/complete', ExpenseReceiptCompleteView.as_view(), name='expense-report-receipts-complete'),
     path('/<uuid:report_id>/items', include(report_item_patterns)),
 ]
 
 urlpatterns = [
     path('reports', include(report_patterns)),
+    path('storage/<str:token>', ReceiptStorageObjectView.as_view(), name='receipt-storage-object'),
 ]
\ No newline at end of file
@@ -1,13 +1,19 @@
 # utils.py
 import boto3
 import logging
+import threading
+import time
+from collections import OrderedDict
 from botocore.config import Config
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
-def get_s3_client():
+
+def create_s3_client():
     s3_client_kwargs = {
         "region_name": getattr(settings, "AWS_DEFAULT_REGION", "us-east-1")
     }
@@ -23,21 +29,88 @@ def get_s3_client():
             }
         )
 
-    return boto3.client(
-        "s3", config=Config(signature_version="s3v4"), **s3_client_kwargs
+    endpoint_url = getattr(settings, "AWS_S3_ENDPOINT_URL", None)
+    if endpoint_url:
+        s3_client_kwargs["endpoint_url"] = endpoint_url
+
+    config = Config(
+        signature_version="s3v4",
+        max_pool_connections=getattr(settings, "AWS_S3_MAX_POOL_CONNECTIONS", 20),
+        retries={"max_attempts": 3, "mode": "standard"},
     )
+    # Sessions are not thread-safe, clients are: build the client from a private session once.
+    return boto3.session.Session().client("s3", config=config, **s3_client_kwargs)
+
+
+def get_s3_client():
+    """Return the process-wide S3 client, creating it on first use."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = create_s3_client()
+    return _s3_client
+
+
+def get_bucket_name():
+    return getattr(settings, "AWS_S3_BUCKET_NAME", "iexpense-receipts")
+
+
+class PresignedUrlCache:
+    """Keeps generated URLs until too little of their validity is left to hand them out again."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+
+    def get(self, key, min_remaining):
+        with self._lock:
+            entry = self._urls.get(key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if expires_at - time.monotonic() < min_remaining:
+                del self._urls[key]
+                return None
+            return url
 
+    def set(self, key, url, expires_in):
+        with self._lock:
+            self._urls[key] = (url, time.monotonic() + expires_in)
+            self._urls.move_to_end(key)
+            if len(self._urls) > self.max_size:
+                now = time.monotonic()
+                for stale_key in [k for k, (_, expires_at) in self._urls.items() if expires_at <= now]:
+                    del self._urls[stale_key]
+                while len(self._urls) > self.max_size:
+                    self._urls.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+presigned_url_cache = PresignedUrlCache(getattr(settings, "AWS_PRESIGNED_URL_CACHE_SIZE", 10000))
+
+
+def generate_presigned_url(object_name, operation="put_object", expiration=300, params=None):
+    # Upload URLs are single-use, so only read URLs are cached.
+    cacheable = operation == "get_object" and not params
+    cache_key = (object_name, operation, expiration)
+    if cacheable:
+        url = presigned_url_cache.get(cache_key, min_remaining=expiration / 2)
+        if url:
+            return url
 
-def generate_presigned_url(object_name, operation="put_object", expiration=300):
-    print("===============================================")
-    print(operation)
     s3_client = get_s3_client()
     try:
         response = s3_client.generate_presigned_url(
             operation,
             Params={
-                "Bucket": getattr(settings, "AWS_S3_BUCKET_NAME", "iexpense-receipts"),
+                "Bucket": get_bucket_name(),
                 "Key": object_name,
+                **(params or {}),
             },
             ExpiresIn=expiration,
         )
@@ -45,16 +118,21 @@ def generate_presigned_url(object_name, operation="put_object", expiration=300):
         logger.error(e)
         return None
 
+    if cacheable:
+        presigned_url_cache.set(cache_key, response, expiration)
     return response
 
 
-def delete_s3_file(object_name):
-    s3_client = get_s3_client()
-    try:
-        s3_client.delete_object(
-            Bucket=getattr(settings, "AWS_S3_BUCKET_NAME", "iexpense-receipts"),
-            Key=object_name,
-        )
-    except Exception as e:
-        logger.error(e)
-        raise Exception("Failed to delete S3 file: " + str(e))
+def bulk_create_with_pks(model, objs, lookup, batch_size=None):
+    """bulk_create `objs` and return them as a list with their pks set.
+
+    Backends without RETURNING (e.g. MySQL) don't set pks on bulk_create, so there the
+    rows are read back by `lookup`, a field whose value is unique to each new object.
+    """
+    objs = list(objs)
+    model.objects.bulk_create(objs, batch_size=batch_size)
+    if any(obj.pk is None for obj in objs):
+        pks = dict(model.objects.filter(**{f"{lookup}__in": [getattr(obj, lookup) for obj in objs]}).values_list(lookup, "pk"))
+        for obj in objs:
+            obj.pk = pks[getattr(obj, lookup)]
+    return objs
@@ -1,24 +1,38 @@
 # views.py
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import ExpenseReport
-from .serializers import ExpenseReportSerializer
+from django.db.models import Prefetch
+from users.models import User
+from .models import ExpenseItem, ExpenseItemQuerySet, ExpenseReport
+from .exports import EXPORT_DATASETS, EXPORT_FORMATS, stream_export
+from .pagination import ExpenseReportCursorPagination
+from .policy import evaluate_reports
+from .serializers import ExpenseItemSerializer, ExpenseReportSerializer
 from rest_framework.permissions import IsAdminUser
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 # ExpenseReport views
 class ExpenseReportListCreateView(generics.ListCreateAPIView):
     serializer_class = ExpenseReportSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ExpenseReportCursorPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff or user.is_superuser:
             if hasattr(user, "org_id") and user.org_id:
-                return ExpenseReport.objects.filter(user__org_id=user.org_id)
+                return ExpenseReport.objects.filter(user__org_id=user.org_id).select_related('user')
             return ExpenseReport.objects.none()
-        return ExpenseReport.objects.filter(user=self.request.user)
+        return ExpenseReport.objects.filter(user=self.request.user).select_related('user')
 
     def perform_create(self, serializer):
         serializer.save(
@@ -33,10 +47,43 @@ class ExpenseReportDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
     lookup_field = 'report_id'
 
+    def get_expand(self):
+        """Parse ?expand=items,receipts into a set of embedded relations."""
+        if self.request.method != 'GET':
+            return set()
+        expand = self.request.query_params.get('expand', '')
+        return {part.strip().lower() for part in expand.split(',') if part.strip()}
+
     def get_queryset(self):
         if self.request.user.is_staff or self.request.user.is_superuser:
-            return ExpenseReport.objects.all()
-        return ExpenseReport.objects.filter(user=self.request.user)
+            queryset = ExpenseReport.objects.select_related('user')
+        else:
+            queryset = ExpenseReport.objects.filter(user=self.request.user).select_related('user')
+
+        expand = self.get_expand()
+        if 'items' in expand:
+            items = ExpenseItem.objects.select_related(*ExpenseItemQuerySet.LOOKUP_FIELDS).order_by('created_at', 'id')
+            if 'receipts' in expand:
+                items = items.prefetch_related('receipts')
+            queryset = queryset.prefetch_related(
+                Prefetch('expenseitem_set', queryset=items, to_attr='expanded_items')
+            )
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+
+        expand = self.get_expand()
+        if 'items' in expand:
+            context = self.get_serializer_context()
+            context['omit_receipts'] = 'receipts' not in expand
+            if request.query_params.get('presign', '').lower() in ('1', 'true'):
+                context['include_presigned_url'] = True
+                context['read_presigned_url'] = True
+            data['items'] = ExpenseItemSerializer(instance.expanded_items, many=True, context=context).data
+
+        return Response(data)
     
     # def perform_update(self, serializer):
     #     print(serializer.validated_data)
@@ -61,14 +108,48 @@ class SubmitReportView(generics.GenericAPIView):
 
     def post(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.report_status = "Submitted"
-        instance.integration_status = "Pending"
-        instance.report_submit_date = timezone.now().date()
-        instance.save()
+        target_status = ExpenseReport.ReportStatus.SUBMITTED
+        with transaction.atomic():
+            # Conditional on the current status, so a report approved or paid meanwhile can't be resubmitted.
+            updated = ExpenseReport.objects.filter(
+                pk=instance.pk, report_status__in=ExpenseReport.source_statuses(target_status)
+            ).update(**ExpenseReport.status_changes(target_status))
+            if not updated:
+                return Response(
+                    {"result": "error", "message": f"A report in status {instance.report_status} can't be submitted."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            # Pins each item's hotel/mileage limits and stores its policy violations for reviewers.
+            evaluate_reports([instance])
+        instance.refresh_from_db()
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
+class ReportPolicyViolationsView(generics.GenericAPIView):
+    """Items of a report that broke a policy rule when it was last checked."""
+    serializer_class = ExpenseReportSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        report_id = self.kwargs.get('report_id')
+        if request.user.is_staff or request.user.is_superuser:
+            report = get_object_or_404(ExpenseReport, report_id=report_id)
+        else:
+            report = get_object_or_404(ExpenseReport, report_id=report_id, user=request.user)
+
+        items = (
+            ExpenseItem.objects.filter(report=report)
+            .exclude(policy_violations=[])
+            .order_by('expense_date', 'id')
+            .values('item_id', 'expense_type', 'expense_date', 'receipt_amount', 'receipt_currency', 'policy_violations', 'policy_checked_at')
+        )
+        return Response({
+            "report_id": str(report.report_id),
+            "items": [{"id": item.pop('item_id'), **item} for item in items],
+        }, status=status.HTTP_200_OK)
+
+
 class UpdateReportStatusView(generics.UpdateAPIView):
     serializer_class = ExpenseReportSerializer
     permission_classes = [IsAdminUser]
@@ -79,9 +160,140 @@ class UpdateReportStatusView(generics.UpdateAPIView):
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.report_status = request.data.get("report_status", instance.report_status)
-        instance.save()
+        target_status = request.data.get("report_status")
+        if target_status not in ExpenseReport.ReportStatus.values:
+            return Response({"result": "error", "message": f"Invalid report_status {target_status}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = ExpenseReport.objects.filter(
+            pk=instance.pk, report_status__in=ExpenseReport.source_statuses(target_status)
+        ).update(**ExpenseReport.status_changes(target_status))
+        if not updated:
+            return Response(
+                {"result": "error", "message": f"Cannot move report from {instance.report_status} to {target_status}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        instance.refresh_from_db()
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+
+def get_admin_report_queryset(user):
+    if getattr(user, "org_id", None):
+        # A subquery rather than a join, so FOR UPDATE only locks expense_report rows.
+        return ExpenseReport.objects.filter(user__in=User.objects.filter(org_id=user.org_id).values('pk'))
+    return ExpenseReport.objects.all()
+
+
+class BatchUpdateReportStatusView(generics.GenericAPIView):
+    serializer_class = ExpenseReportSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """Move many reports to one status with a single conditional UPDATE."""
+        target_status = request.data.get("report_status")
+        report_ids = request.data.get("report_ids")
+        if target_status not in ExpenseReport.ReportStatus.values:
+            return Response({"result": "error", "message": f"Invalid report_status {target_status}."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(report_ids, list) or not report_ids:
+            return Response({"result": "error", "message": "report_ids must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        max_reports = getattr(settings, "REPORT_BATCH_STATUS_MAX", 1000)
+        if len(report_ids) > max_reports:
+            return Response({"result": "error", "message": f"At most {max_reports} reports can be updated per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        report_ids = [str(report_id) for report_id in report_ids]
+        queryset = get_admin_report_queryset(request.user)
+        try:
+            current = {str(report_id): report_status for report_id, report_status in queryset.filter(report_id__in=report_ids).values_list('report_id', 'report_status')}
+        except DjangoValidationError:
+            return Response({"result": "error", "message": "report_ids must be UUIDs."}, status=status.HTTP_400_BAD_REQUEST)
+
+        source_statuses = ExpenseReport.source_statuses(target_status)
+        eligible = [report_id for report_id in report_ids if current.get(report_id) in source_statuses]
+
+        changes = ExpenseReport.status_changes(target_status)
+
+        updated = set()
+        if eligible:
+            with transaction.atomic():
+                queryset.filter(report_id__in=eligible, report_status__in=source_statuses).update(**changes)
+                # Another approver may have moved some reports between our read and the UPDATE.
+                updated = {str(report_id) for report_id in queryset.filter(report_id__in=eligible, report_status=target_status).values_list('report_id', flat=True)}
+
+        results = []
+        for report_id in report_ids:
+            if report_id not in current:
+                result = 'not_found'
+            elif report_id in updated:
+                result = 'updated'
+            elif report_id in eligible:
+                result = 'conflict'
+            else:
+                result = 'invalid_transition'
+            results.append({"id": report_id, "from": current.get(report_id), "to": target_status, "status": result})
+
+        return Response({"result": "success", "updated": len(updated), "results": results}, status=status.HTTP_200_OK)
+
+
+class ClaimReportsView(generics.GenericAPIView):
+    serializer_class = ExpenseReportSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        """Claim the next N submitted reports for review, skipping rows other approvers hold locked."""
+        try:
+            limit = min(max(int(request.data.get("limit", 10)), 1), getattr(settings, "REPORT_CLAIM_MAX", 100))
+        except (TypeError, ValueError):
+            return Response({"result": "error", "message": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        lease_expired = now - timedelta(seconds=getattr(settings, "REPORT_CLAIM_LEASE_SECONDS", 1800))
+        queryset = get_admin_report_queryset(request.user)
+
+        with transaction.atomic():
+            claimed_ids = list(
+                queryset.select_for_update(skip_locked=True)
+                .filter(report_status=ExpenseReport.ReportStatus.SUBMITTED)
+                .filter(Q(claimed_by__isnull=True) | Q(claimed_at__lt=lease_expired))
+                .order_by('report_submit_date', 'id')
+                .values_list('pk', flat=True)[:limit]
+            )
+            if claimed_ids:
+                ExpenseReport.objects.filter(pk__in=claimed_ids).update(claimed_by=request.user, claimed_at=now)
+
+        reports = ExpenseReport.objects.filter(pk__in=claimed_ids).select_related('user').order_by('report_submit_date', 'id')
+        serializer = self.get_serializer(reports, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ExpenseExportView(generics.GenericAPIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        """Stream every report or item of the admin's org as CSV or JSONL."""
+        dataset = request.query_params.get('dataset', 'items')
+        file_format = request.query_params.get('file_format', 'csv')
+        if dataset not in EXPORT_DATASETS or file_format not in EXPORT_FORMATS:
+            return Response(
+                {"result": "error", "message": f"dataset must be one of {EXPORT_DATASETS} and file_format one of {EXPORT_FORMATS}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        org_id = getattr(request.user, 'org_id', None)
+        if not org_id and request.user.is_superuser:
+            org_id = request.query_params.get('org_id') or None
+        if not org_id and not request.user.is_superuser:
+            return Response({"result": "error", "message": "No organization assigned to this user."}, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = parse_date(request.query_params.get('start') or '')
+        end_date = parse_date(request.query_params.get('end') or '')
+        if (request.query_params.get('start') and not start_date) or (request.query_params.get('end') and not end_date):
+            return Response({"result": "error", "message": "start and end must be dates in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            stream_export(dataset, file_format, org_id=org_id, start_date=start_date, end_date=end_date),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="expense-{dataset}.{file_format}"'
+        return response